@@ -0,0 +1,201 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+import click
+from sqlalchemy import create_engine, text
+
+from ingest_data_v2 import (
+    create_checkpoint_table,
+    create_table,
+    load_chunk,
+    parse_column_type,
+    read_chunks,
+    reset_checkpoints,
+    source_url,
+)
+
+# Column the parent table is range-partitioned on, one partition per month
+partition_column = 'tpep_pickup_datetime'
+
+def parse_month(value):
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise click.BadParameter(f"expected YYYY-MM, got '{value}'")
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def month_range(start, end):
+    months = []
+    current = start
+    while current <= end:
+        months.append(current)
+        current = next_month(current)
+    return months
+
+def create_parent(engine, df_chunk, target_table, column_types):
+    """Create the partitioned parent table with the same columns as a standalone load."""
+    template = f'{target_table}__template'
+    create_table(engine, df_chunk, template, overrides = column_types)
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{target_table}" (LIKE "{template}") '
+            f'PARTITION BY RANGE ("{partition_column}")'
+        ))
+        conn.execute(text(f'DROP TABLE "{template}"'))
+
+def is_partitioned(engine, target_table):
+    with engine.connect() as conn:
+        relkind = conn.execute(
+            text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+            {'name': f'"{target_table}"'}
+        ).scalar()
+
+    if relkind is not None and relkind != 'p':
+        raise click.ClickException(
+            f"{target_table} exists but is not partitioned; drop it or pick another --target-table"
+        )
+    return relkind == 'p'
+
+def detach_partition(engine, target_table, partition):
+    # Reloading a month only ever touches its own partition
+    with engine.begin() as conn:
+        attached = conn.execute(
+            text("""
+                SELECT 1 FROM pg_inherits
+                 WHERE inhrelid = to_regclass(:partition) AND inhparent = to_regclass(:parent)
+            """),
+            {'partition': f'"{partition}"', 'parent': f'"{target_table}"'}
+        ).scalar()
+
+        if attached:
+            conn.execute(text(f'ALTER TABLE "{target_table}" DETACH PARTITION "{partition}"'))
+        conn.execute(text(f'DROP TABLE IF EXISTS "{partition}"'))
+
+def attach_partition(engine, target_table, partition, month):
+    lower, upper = month.isoformat(), next_month(month).isoformat()
+
+    with engine.begin() as conn:
+        # A matching CHECK constraint lets ATTACH skip its own validation scan
+        conn.execute(text(f"""
+            ALTER TABLE "{partition}" ADD CONSTRAINT "{partition}_bounds"
+            CHECK ("{partition_column}" IS NOT NULL
+               AND "{partition_column}" >= '{lower}' AND "{partition_column}" < '{upper}')
+        """))
+        conn.execute(text(
+            f'ALTER TABLE "{target_table}" ATTACH PARTITION "{partition}" '
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+        conn.execute(text(f'ALTER TABLE "{partition}" DROP CONSTRAINT "{partition}_bounds"'))
+
+def load_month(engine, target_table, month, chunksize, load_method, csv_engine, column_types,
+               parent_state):
+    """Load one month into its own table, then attach it as a partition."""
+    url = source_url(month.year, month.month)
+    partition = f'{target_table}_{month.year}_{month.month:02d}'
+    lower, upper = month.isoformat(), next_month(month).isoformat()
+
+    detach_partition(engine, target_table, partition)
+    reset_checkpoints(engine, url, partition)
+
+    dbapi_conn = engine.raw_connection() if load_method == 'copy' else None
+    rows = 0
+    dropped = 0
+    start = time.perf_counter()
+
+    try:
+        for chunk_index, df_chunk in enumerate(read_chunks(url, chunksize, csv_engine)):
+            # The monthly files contain a few trips from other months (and some
+            # with no pickup time); those cannot go into this month's partition
+            pickup = df_chunk[partition_column]
+            in_month = (pickup >= lower) & (pickup < upper)
+            dropped += int((~in_month).sum())
+            df_chunk = df_chunk[in_month]
+
+            with parent_state['lock']:
+                if not parent_state['ready']:
+                    create_parent(engine, df_chunk, target_table, column_types)
+                    parent_state['ready'] = True
+
+            if chunk_index == 0:
+                # Partitions must match the parent's column types exactly
+                create_table(engine, df_chunk, partition, overrides = column_types)
+
+            load_chunk(engine, dbapi_conn, df_chunk, partition, url, chunk_index, load_method, chunksize = chunksize)
+            rows += len(df_chunk)
+    finally:
+        if dbapi_conn is not None:
+            dbapi_conn.close()
+
+    attach_partition(engine, target_table, partition, month)
+
+    elapsed = time.perf_counter() - start
+    print(f"{partition}: {rows} rows in {elapsed:.1f}s, {dropped} rows outside {month:%Y-%m} skipped")
+    return rows
+
+@click.command()
+@click.option('--pg-user', default = 'root', help = 'PostgreSQL username')
+@click.option('--pg-pass', default = 'root', help = 'PostgreSQL password')
+@click.option('--pg-host', default = 'localhost', help = 'PostgreSQL host')
+@click.option('--pg-port', default = '5432', help = 'PostgreSQL port')
+@click.option('--pg-db', default = 'ny_taxi', help = 'PostgreSQL database name')
+@click.option('--start', 'start_month', default = '2021-01', help = 'First month to load (YYYY-MM)')
+@click.option('--end', 'end_month', default = '2021-07', help = 'Last month to load, inclusive (YYYY-MM)')
+@click.option('--parallel', default = 3, type = click.IntRange(min = 1), help = 'Months loaded concurrently')
+@click.option('--chunksize', default = 100000, type = int, help = 'Chunk size for ingestion')
+@click.option('--target-table', default = 'yellow_taxi_data', help = 'Partitioned parent table name')
+@click.option('--load-method', default = 'copy', type = click.Choice(['insert', 'copy']), help = 'Load chunks with to_sql INSERTs or COPY FROM STDIN')
+@click.option('--csv-engine', default = 'pandas', type = click.Choice(['pandas', 'arrow']), help = 'CSV parser: pandas or multi-threaded pyarrow.csv')
+@click.option('--column-type', 'column_types', multiple = True, help = 'Postgres type for a column instead of the compact default, as COLUMN=TYPE (repeatable)')
+
+def backfill(pg_user, pg_pass, pg_host, pg_port, pg_db, start_month, end_month, parallel, chunksize, target_table,
+             load_method, csv_engine, column_types):
+    months = month_range(parse_month(start_month), parse_month(end_month))
+    column_types = dict(parse_column_type(spec) for spec in column_types)
+    if not months:
+        raise click.BadParameter('--end is before --start')
+
+    # COPY goes through psycopg (v3), the INSERT path keeps the default psycopg2 driver
+    driver = 'postgresql+psycopg' if load_method == 'copy' else 'postgresql'
+    engine = create_engine(
+        f'{driver}://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}',
+        pool_size = 2 * parallel + 1
+    )
+
+    create_checkpoint_table(engine)
+
+    # The parent is created from the first chunk any month reads, unless it already exists
+    parent_state = {'lock': threading.Lock(), 'ready': is_partitioned(engine, target_table)}
+
+    print(f"Backfilling {len(months)} months into {target_table} ({parallel} at a time)")
+
+    total_rows = 0
+    failed = []
+
+    with ThreadPoolExecutor(max_workers = parallel) as executor:
+        futures = {
+            executor.submit(load_month, engine, target_table, month, chunksize, load_method, csv_engine,
+                            column_types, parent_state): month
+            for month in months
+        }
+
+        for future in as_completed(futures):
+            month = futures[future]
+            try:
+                total_rows += future.result()
+            except Exception as e:
+                print(f"{month:%Y-%m} failed: {e}")
+                failed.append(month)
+
+    print(f"Loaded {total_rows} rows into {len(months) - len(failed)} partitions")
+
+    if failed:
+        raise click.ClickException(f"{len(failed)} month(s) failed: {', '.join(f'{m:%Y-%m}' for m in failed)}")
+
+if __name__ == '__main__':
+    backfill()
@@ -0,0 +1,337 @@
+"""
+Ingestion benchmark for the Postgres loaders.
+
+Generates synthetic yellow (CSV) and green (parquet) trip files with the real
+column set and dtypes, then loads them into a local Postgres with every
+combination of load method, CSV parser and chunk size, e.g.
+
+    python benchmark_ingest.py --rows 500000 --chunksize 10000 --chunksize 100000
+
+Each case runs in a fresh subprocess so its peak RSS is its own. For every
+case it reports rows/s, MB/s (size of the loaded Postgres table over wall
+time), client time spent reading and loading, the time Postgres reports its
+sessions as active (pg_stat_database.active_time, which leaves out parse and
+bind work) and peak RSS. Results are printed as a table and written to JSON
+so runs can be compared over time.
+
+Scope: every case, green included, is loaded by ingest_data_v2's
+create_table and load_chunk, so the load methods are the v2 ones. The
+green parquet file is only read the way exercise/ingest_data.py reads it
+(iter_batches); that ingester's own loaders (--sink pandas / adbc, parallel
+row groups) are not benchmarked here. "pandas" and "arrow" select the CSV
+parser only.
+"""
+
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import create_engine, text
+
+from ingest_data_v2 import (
+    create_checkpoint_table,
+    create_table,
+    load_chunk,
+    read_chunks,
+    reset_checkpoints,
+)
+
+# --load-method values of ingest_data_v2; copy is CSV COPY FROM STDIN
+methods = ('insert', 'multi', 'copy')
+
+scope = (
+    "All cases load through ingest_data_v2 (create_table / load_chunk); green is read with "
+    "pyarrow iter_batches, exercise/ingest_data.py's --sink pandas / adbc loaders are not measured. "
+    "The parser column is the CSV parser (parquet: no CSV parsing)."
+)
+
+yellow_columns = [
+    "VendorID", "tpep_pickup_datetime", "tpep_dropoff_datetime", "passenger_count", "trip_distance",
+    "RatecodeID", "store_and_fwd_flag", "PULocationID", "DOLocationID", "payment_type", "fare_amount",
+    "extra", "mta_tax", "tip_amount", "tolls_amount", "improvement_surcharge", "total_amount",
+    "congestion_surcharge"
+]
+
+# Schema of the green trip parquet files published by the TLC
+green_schema = pa.schema([
+    ("VendorID", pa.int32()),
+    ("lpep_pickup_datetime", pa.timestamp("us")),
+    ("lpep_dropoff_datetime", pa.timestamp("us")),
+    ("store_and_fwd_flag", pa.string()),
+    ("RatecodeID", pa.int64()),
+    ("PULocationID", pa.int32()),
+    ("DOLocationID", pa.int32()),
+    ("passenger_count", pa.int64()),
+    ("trip_distance", pa.float64()),
+    ("fare_amount", pa.float64()),
+    ("extra", pa.float64()),
+    ("mta_tax", pa.float64()),
+    ("tip_amount", pa.float64()),
+    ("tolls_amount", pa.float64()),
+    ("ehail_fee", pa.float64()),
+    ("improvement_surcharge", pa.float64()),
+    ("total_amount", pa.float64()),
+    ("payment_type", pa.int64()),
+    ("trip_type", pa.int64()),
+    ("congestion_surcharge", pa.float64()),
+    ("cbd_congestion_fee", pa.float64()),
+])
+
+def synthetic_trips(rows, seed):
+    """Columns shared by both colours, with roughly realistic distributions."""
+    rng = np.random.default_rng(seed)
+    pickup = np.datetime64('2021-01-01T00:00:00') + rng.integers(0, 31 * 86400, rows).astype('timedelta64[s]')
+    # About 2% of the rows have the optional fields missing, as in the real files
+    missing = rng.random(rows) < 0.02
+
+    def optional(values, dtype = "Int64"):
+        values = pd.array(values, dtype = dtype)
+        values[missing] = pd.NA
+        return values
+
+    return rng, {
+        "VendorID": optional(rng.integers(1, 3, rows)),
+        "pickup_datetime": pickup,
+        "dropoff_datetime": pickup + rng.integers(60, 3600, rows).astype('timedelta64[s]'),
+        "passenger_count": optional(rng.integers(1, 6, rows)),
+        "trip_distance": rng.gamma(1.5, 2.0, rows).round(2),
+        "RatecodeID": optional(rng.integers(1, 6, rows)),
+        "store_and_fwd_flag": optional(rng.choice(["N", "Y"], rows, p = [0.99, 0.01]), "string"),
+        "PULocationID": rng.integers(1, 266, rows),
+        "DOLocationID": rng.integers(1, 266, rows),
+        "payment_type": optional(rng.integers(1, 5, rows)),
+        "fare_amount": rng.gamma(2.0, 7.0, rows).round(2),
+        "extra": rng.choice([0.0, 0.5, 1.0, 2.5], rows),
+        "mta_tax": np.full(rows, 0.5),
+        "tip_amount": rng.gamma(1.0, 2.0, rows).round(2),
+        "tolls_amount": np.where(rng.random(rows) < 0.05, 6.55, 0.0),
+        "improvement_surcharge": np.full(rows, 0.3),
+        "total_amount": rng.gamma(2.0, 10.0, rows).round(2),
+        "congestion_surcharge": np.where(rng.random(rows) < 0.9, 2.5, 0.0),
+    }
+
+def write_yellow(path, rows, seed):
+    _, columns = synthetic_trips(rows, seed)
+    columns["tpep_pickup_datetime"] = columns.pop("pickup_datetime")
+    columns["tpep_dropoff_datetime"] = columns.pop("dropoff_datetime")
+    df = pd.DataFrame(columns)[yellow_columns]
+    df.to_csv(path, index = False, compression = 'gzip')
+
+def write_green(path, rows, seed):
+    rng, columns = synthetic_trips(rows, seed)
+    columns["lpep_pickup_datetime"] = columns.pop("pickup_datetime")
+    columns["lpep_dropoff_datetime"] = columns.pop("dropoff_datetime")
+    columns["ehail_fee"] = np.full(rows, np.nan)
+    columns["trip_type"] = pd.array(rng.integers(1, 3, rows), dtype = "Int64")
+    columns["cbd_congestion_fee"] = np.where(rng.random(rows) < 0.3, 0.75, 0.0)
+    df = pd.DataFrame(columns)[green_schema.names]
+    table = pa.Table.from_pandas(df, schema = green_schema, preserve_index = False)
+    pq.write_table(table, path, row_group_size = 122880)
+
+def dataset_path(data_dir, dataset, rows, seed):
+    suffix = 'csv.gz' if dataset == 'yellow' else 'parquet'
+    path = os.path.join(data_dir, f'{dataset}_{rows}_{seed}.{suffix}')
+
+    # Generated files are reused across runs with the same size and seed
+    if not os.path.exists(path):
+        print(f"Generating {rows} synthetic {dataset} rows in {path}")
+        writer = write_yellow if dataset == 'yellow' else write_green
+        writer(path + '.tmp', rows, seed)
+        os.replace(path + '.tmp', path)
+    return path
+
+def read_source(path, dataset, chunksize, csv_engine):
+    if dataset == 'yellow':
+        return read_chunks(path, chunksize, csv_engine)
+
+    # Batched like exercise/ingest_data.py reads it; loaded by the v2 loader all the same
+    parquet_file = pq.ParquetFile(path)
+    return (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size = chunksize))
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+def run_case(db_url, case):
+    """Load one file with one configuration; runs in its own process."""
+    load_method = case['method']
+    driver = 'postgresql+psycopg' if load_method == 'copy' else 'postgresql'
+    engine = create_engine(db_url.replace('postgresql', driver, 1))
+    dbapi_conn = engine.raw_connection() if load_method == 'copy' else None
+
+    rows = 0
+    read_time = 0.0
+    load_time = 0.0
+    start = time.perf_counter()
+
+    try:
+        chunks = read_source(case['path'], case['dataset'], case['chunksize'], case['csv_engine'])
+
+        for chunk_index in itertools.count():
+            read_start = time.perf_counter()
+            df_chunk = next(chunks, None)
+            read_time += time.perf_counter() - read_start
+
+            if df_chunk is None:
+                break
+
+            if chunk_index == 0:
+                create_table(engine, df_chunk, case['table'])
+
+            load_start = time.perf_counter()
+            load_chunk(engine, dbapi_conn, df_chunk, case['table'], case['url'], chunk_index, load_method)
+            load_time += time.perf_counter() - load_start
+            rows += len(df_chunk)
+    finally:
+        if dbapi_conn is not None:
+            dbapi_conn.close()
+        # Closing the session makes Postgres flush its activity statistics
+        engine.dispose()
+
+    return {
+        'rows': rows,
+        'wall_s': time.perf_counter() - start,
+        'read_s': read_time,
+        'load_s': load_time,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+def db_active_seconds(engine):
+    # Time Postgres backends spent executing statements in this database (PG 14+)
+    with engine.connect() as conn:
+        conn.execute(text('SELECT pg_stat_clear_snapshot()'))
+        active_ms = conn.execute(
+            text('SELECT active_time FROM pg_stat_database WHERE datname = current_database()')
+        ).scalar()
+    return None if active_ms is None else active_ms / 1000
+
+def table_mb(engine, table):
+    with engine.connect() as conn:
+        size = conn.execute(text('SELECT pg_table_size(to_regclass(:name))'), {'name': f'"{table}"'}).scalar()
+    return (size or 0) / 1024 ** 2
+
+def benchmark_case(engine, db_url, case):
+    active_before = db_active_seconds(engine)
+
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--db-url', db_url, '--case', json.dumps(case)],
+        capture_output = True,
+        text = True
+    )
+    if process.returncode != 0:
+        raise click.ClickException(f"case {case} failed:\n{process.stderr}")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+
+    # The session's statistics are flushed as its backend exits, shortly after the client
+    time.sleep(1)
+    active_after = db_active_seconds(engine)
+
+    result['table_mb'] = table_mb(engine, case['table'])
+    result['rows_per_s'] = result['rows'] / result['wall_s']
+    result['mb_per_s'] = result['table_mb'] / result['wall_s']
+    result['db_active_s'] = None if active_before is None else active_after - active_before
+
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP TABLE IF EXISTS "{case["table"]}"'))
+    reset_checkpoints(engine, case['url'], case['table'])
+
+    return {key: value for key, value in case.items() if key not in ('path', 'url', 'table')} | result
+
+def print_table(results):
+    header = f"{'dataset':<8} {'parser':<8} {'method':<12} {'chunk':>8} {'rows/s':>10} {'MB/s':>7} " \
+             f"{'read s':>7} {'load s':>7} {'db s':>7} {'RSS MB':>7}"
+    print(header)
+    print('-' * len(header))
+
+    for r in results:
+        db_time = '-' if r['db_active_s'] is None else f"{r['db_active_s']:.2f}"
+        print(
+            f"{r['dataset']:<8} {r['csv_engine']:<8} {r['method']:<12} {r['chunksize']:>8} "
+            f"{r['rows_per_s']:>10,.0f} {r['mb_per_s']:>7.1f} {r['read_s']:>7.2f} {r['load_s']:>7.2f} "
+            f"{db_time:>7} {r['peak_rss_mb']:>7.0f}"
+        )
+
+@click.command()
+@click.option('--pg-user', default = 'root', help = 'PostgreSQL username')
+@click.option('--pg-pass', default = 'root', help = 'PostgreSQL password')
+@click.option('--pg-host', default = 'localhost', help = 'PostgreSQL host')
+@click.option('--pg-port', default = '5432', help = 'PostgreSQL port')
+@click.option('--pg-db', default = 'ny_taxi', help = 'PostgreSQL database name')
+@click.option('--dataset', 'datasets', multiple = True, type = click.Choice(['yellow', 'green']), help = 'Datasets to load (repeatable; default both)')
+@click.option('--method', 'method_names', multiple = True, type = click.Choice(list(methods)), help = 'Load methods to compare (repeatable; default all)')
+@click.option('--csv-engine', 'csv_engines', multiple = True, type = click.Choice(['pandas', 'arrow']), help = 'CSV parsers for the yellow CSV (repeatable; default both)')
+@click.option('--chunksize', 'chunksizes', multiple = True, type = int, help = 'Chunk sizes to try (repeatable; default 10000 and 100000)')
+@click.option('--rows', default = 200000, type = int, help = 'Rows of synthetic data per dataset')
+@click.option('--seed', default = 0, type = int, help = 'Random seed for the synthetic data')
+@click.option('--repeat', default = 1, type = click.IntRange(min = 1), help = 'Runs per case')
+@click.option('--data-dir', default = os.path.join(tempfile.gettempdir(), 'ingest_benchmark'), help = 'Where the synthetic files are kept')
+@click.option('--output', default = 'benchmark_results.json', help = 'JSON file for the results')
+@click.option('--db-url', hidden = True)
+@click.option('--case', 'case_json', hidden = True)
+
+def benchmark(pg_user, pg_pass, pg_host, pg_port, pg_db, datasets, method_names, csv_engines, chunksizes, rows, seed,
+              repeat, data_dir, output, db_url, case_json):
+    if case_json:
+        # Child process: run a single case and report back on stdout
+        print(json.dumps(run_case(db_url, json.loads(case_json))))
+        return
+
+    db_url = f'postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}'
+    engine = create_engine(db_url)
+    create_checkpoint_table(engine)
+    os.makedirs(data_dir, exist_ok = True)
+
+    cases = []
+    for dataset in datasets or ('yellow', 'green'):
+        path = dataset_path(data_dir, dataset, rows, seed)
+        # The green data is parquet, so the CSV parser does not apply
+        parsers = (csv_engines or ('pandas', 'arrow')) if dataset == 'yellow' else ('parquet',)
+
+        for csv_engine, method, chunksize in itertools.product(parsers, method_names or methods, chunksizes or (10000, 100000)):
+            cases.append({
+                'dataset': dataset,
+                'csv_engine': csv_engine,
+                'method': method,
+                'chunksize': chunksize,
+                'path': path,
+                'url': f'benchmark://{os.path.basename(path)}',
+                'table': f'benchmark_{dataset}'
+            })
+
+    results = []
+    for case in cases:
+        for run_index in range(repeat):
+            print(f"Running {case['dataset']} / {case['csv_engine']} / {case['method']} / chunksize {case['chunksize']}"
+                  f"{f' (run {run_index + 1})' if repeat > 1 else ''}")
+            results.append(benchmark_case(engine, db_url, case) | {'run': run_index + 1})
+
+    print()
+    print_table(results)
+    print(f"\n{scope}")
+
+    with open(output, 'w') as f:
+        json.dump({
+            'rows': rows,
+            'seed': seed,
+            'postgres': f'{pg_host}:{pg_port}/{pg_db}',
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'scope': scope,
+            'results': results
+        }, f, indent = 2)
+
+    print(f"\nResults written to {output}")
+
+if __name__ == '__main__':
+    benchmark()
@@ -1,11 +1,17 @@
 import os
 import sys
-import urllib.request
+from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor
 from google.cloud import storage
 from google.api_core.exceptions import NotFound, Forbidden
 import time
 
+# Shared TLC download cache lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tlc_cache
+import tlc_download
+import tlc_storage
+
 # Change this to your bucket name
 BUCKET_NAME = "sandbox-486719-nyc-taxi-raw"
 
@@ -21,17 +27,31 @@ MONTHS = [f"{i:02d}" for i in range(1, 7)]
 DOWNLOAD_DIR = "data"
 CHUNK_SIZE = 8 * 1024 * 1024
 
+# Pipe each download straight into a resumable GCS upload instead of going through DOWNLOAD_DIR
+STREAM_UPLOADS = False
+
+# Files over the threshold are uploaded as COMPOSITE_PARTS parts in parallel and composed in GCS
+COMPOSITE_THRESHOLD = 64 * 1024 * 1024
+COMPOSITE_PARTS = 8
+COMPOSITE_WORKERS = 8
+
 os.makedirs(DOWNLOAD_DIR, exist_ok = True)
 
+# Shared by all download threads: 4 range requests per file, at most 8 in flight overall
+downloader = tlc_download.RangeDownloader(connections = 4, max_connections = 8)
+
 bucket = client.bucket(BUCKET_NAME)
 
+# Destination of every upload, streamed or not; tlc_storage.LocalBackend("gcs") stands in for GCS in local tests
+storage_backend = tlc_storage.GCSBackend(bucket, chunk_size = CHUNK_SIZE)
+
 def download_file(month):
     url = f"{BASE_URL}{month}.parquet"
     file_path = os.path.join(DOWNLOAD_DIR, f"yellow_tripdata_2024-{month}.parquet")
 
     try:
         print(f"Downloading {url}...")
-        urllib.request.urlretrieve(url, file_path)
+        tlc_cache.fetch(url, dest = file_path, downloader = downloader)
         print(f"Downloaded: {file_path}")
         return file_path
     except Exception as e:
@@ -66,27 +86,23 @@ def create_bucket(bucket_name):
         )
         sys.exit(1)
 
-def verify_gcs_upload(blob_name):
-    return storage.Blob(bucket = bucket, name = blob_name).exists(client)
-
-def upload_to_gcs(file_path, max_retries = 3):
+def upload_to_gcs(file_path, remote = None, max_retries = 3):
+    # remote is the bucket listing taken once at the start; identical objects are skipped
     blob_name = os.path.basename(file_path)
-    blob = bucket.blob(blob_name)
-    blob.chunk_size = CHUNK_SIZE
-
-    create_bucket(BUCKET_NAME)
 
     for attempt in range(max_retries):
         try:
             print(f"Uploading {file_path} to {BUCKET_NAME} (Attempt {attempt + 1})...")
-            blob.upload_from_filename(file_path)
-            print(f"Uploaded: gs://{BUCKET_NAME}/{blob_name}")
-
-            if verify_gcs_upload(blob_name):
-                print(f"Verification successful for {blob_name}")
-                return
+            # A failed attempt may have changed the object, so retries look it up again
+            parts = tlc_storage.sync_file(
+                storage_backend, file_path, blob_name, remote if attempt == 0 else None,
+                threshold = COMPOSITE_THRESHOLD, parts = COMPOSITE_PARTS, workers = COMPOSITE_WORKERS
+            )
+            if parts:
+                print(f"Uploaded and verified: gs://{BUCKET_NAME}/{blob_name} ({parts} part{'s' if parts > 1 else ''})")
             else:
-                print(f"Verification failed for {blob_name}, retrying...")
+                print(f"Unchanged, skipped: gs://{BUCKET_NAME}/{blob_name}")
+            return
         except Exception as e:
             print(f"Failed to upload {file_path} to GCS: {e}")
 
@@ -94,14 +110,38 @@ def upload_to_gcs(file_path, max_retries = 3):
 
     print(f"Giving up on {file_path} after {max_retries} attempts.")
 
+def stream_to_gcs(month, max_retries = 3):
+    url = f"{BASE_URL}{month}.parquet"
+    blob_name = f"yellow_tripdata_2024-{month}.parquet"
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Streaming {url} to {storage_backend.uri(blob_name)} (Attempt {attempt + 1})...")
+            # stream_url raises unless the object was written completely
+            copied = tlc_storage.stream_url(url, storage_backend, blob_name)
+            print(f"Uploaded: {storage_backend.uri(blob_name)} ({copied} bytes)")
+            return
+        except Exception as e:
+            print(f"Failed to stream {url} to GCS: {e}")
+
+        time.sleep(5)
+
+    print(f"Giving up on {url} after {max_retries} attempts.")
+
 
 if __name__ == "__main__":
     create_bucket(BUCKET_NAME)
 
-    with ThreadPoolExecutor(max_workers = 4) as executor:
-        file_paths = list(executor.map(download_file, MONTHS))
+    if STREAM_UPLOADS:
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            list(executor.map(stream_to_gcs, MONTHS))
+    else:
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            file_paths = list(executor.map(download_file, MONTHS))
+
+        remote = storage_backend.list()
 
-    with ThreadPoolExecutor(max_workers = 4) as executor:
-        executor.map(upload_to_gcs, filter(None, file_paths))  # Remove None values
+        with ThreadPoolExecutor(max_workers = 4) as executor:
+            executor.map(lambda file_path: upload_to_gcs(file_path, remote), filter(None, file_paths))  # Remove None values
 
     print("All files processed and verified.")
\ No newline at end of file
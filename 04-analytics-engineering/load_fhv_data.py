@@ -1,8 +1,15 @@
 from google.cloud import storage
 import os
-import urllib.request
+import sys
+from pathlib import Path
 import pandas as pd
 
+# Shared TLC download cache lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tlc_cache
+import tlc_storage
+import taxi_schemas
+
 # ================================
 # CONFIG
 # ================================
@@ -12,12 +19,22 @@ DATA_DIR = "data"
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 PARQUET_DIR = os.path.join(DATA_DIR, "parquet")
 
+# The CSV is read and written to parquet this many rows at a time
+CSV_CHUNK_ROWS = 500000
+
+# Parquet layout (taxi_schemas.PROFILES): "scan" sorts row groups by pickup time
+# and adds page indexes and zone bloom filters so date/zone filters skip data
+PARQUET_PROFILE = "scan"
+
 os.makedirs(RAW_DIR, exist_ok = True)
 os.makedirs(PARQUET_DIR, exist_ok = True)
 
 client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
 bucket = client.bucket(BUCKET_NAME)
 
+# Destination of every upload; tlc_storage.LocalBackend("gcs") stands in for GCS in local tests
+storage_backend = tlc_storage.GCSBackend(bucket)
+
 # ================================
 # FHV FILES
 # ================================
@@ -27,104 +44,65 @@ FHV_FILES = [
 
 BASE_URL = "https://github.com/DataTalksClub/nyc-tlc-data/releases/download/fhv"
 
-# ================================
-# COLUMN MAPPING & SCHEMA
-# ================================
-FHV_RENAME = {
-    "dispatching_base_num": "dispatching_base_num",
-    "pickup_datetime": "pickup_datetime",
-    "dropOff_datetime": "dropoff_datetime",
-    "PUlocationID": "pickup_location_id",
-    "DOlocationID": "dropoff_location_id",
-    "SR_Flag": "sr_flag",
-    "Affiliated_base_number": "affiliated_base_number"
-}
-
-FHV_COLUMNS = [
-    "dispatching_base_num",
-    "pickup_datetime",
-    "dropoff_datetime",
-    "pickup_location_id",
-    "dropoff_location_id",
-    "sr_flag",
-    "affiliated_base_number"
-]
-
-DATETIME_COLS = ["pickup_datetime", "dropoff_datetime"]
-
 # ================================
 # FUNCTIONS
 # ================================
 def download_file(file_name):
     url = f"{BASE_URL}/{file_name}"
     file_path = os.path.join(RAW_DIR, file_name)
-    if not os.path.exists(file_path):
-        print(f"Downloading {file_name}...")
-        urllib.request.urlretrieve(url, file_path)
+    print(f"Downloading {file_name}...")
+    tlc_cache.fetch(url, dest = file_path)
     return file_path
 
 def transform_to_parquet(file_path):
     print(f"Processing {os.path.basename(file_path)}...")
-    df = pd.read_csv(file_path, compression = "gzip", low_memory = False)
-
-    # Rename columns
-    df = df.rename(columns=FHV_RENAME)
-
-    # Filter out records where dispatching_base_num is null
-    df = df[df["dispatching_base_num"].notna()]
-
-    # Parse datetimes
-    for col in DATETIME_COLS:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors = "coerce")
-
-    # Ensure all expected columns exist
-    for col in FHV_COLUMNS:
-        if col not in df.columns:
-            df[col] = pd.NA
-
-    # Keep only desired columns in order
-    df = df[FHV_COLUMNS]
+    chunks = pd.read_csv(
+        file_path,
+        compression = "gzip",
+        dtype = taxi_schemas.read_dtypes("fhv"),
+        chunksize = CSV_CHUNK_ROWS,
+        low_memory = False
+    )
 
-    # Force string types before writing parquet
-    df["dispatching_base_num"] = df["dispatching_base_num"].astype("string")
-    df["pickup_location_id"] = df["pickup_location_id"].astype("string")
-    df["dropoff_location_id"] = df["dropoff_location_id"].astype("string")
-    df["sr_flag"] = df["sr_flag"].astype("string")
-    df["affiliated_base_number"] = df["affiliated_base_number"].astype("string")
+    # Filter out records where dispatching_base_num is null, chunk by chunk
+    chunks = (df[df["dispatching_base_num"].notna()] for df in chunks)
 
-    # Save as Parquet
+    # Rename, parse datetimes, cast strings and order the columns as each chunk is written
     parquet_name = os.path.basename(file_path).replace(".csv.gz", ".parquet")
     parquet_path = os.path.join(PARQUET_DIR, parquet_name)
-    df.to_parquet(
-        parquet_path,
-        engine = "pyarrow",
-        index = False,
-        coerce_timestamps = "us",
-        allow_truncated_timestamps = True
-    )
+
+    # Written under a temporary name so an interrupted run never leaves a truncated file
+    try:
+        rows, _ = taxi_schemas.write_parquet(chunks, "fhv", parquet_path + ".tmp", profile = PARQUET_PROFILE)
+    except BaseException:
+        if os.path.exists(parquet_path + ".tmp"):
+            os.remove(parquet_path + ".tmp")
+        raise
+    os.replace(parquet_path + ".tmp", parquet_path)
+    print(f"Wrote {parquet_path} ({rows} rows)")
     return parquet_path
 
-def upload_to_gcs(parquet_path):
+def upload_to_gcs(parquet_path, remote = None):
+    # Skips the upload if the object already has the same checksum, otherwise
+    # replaces it in place (no delete needed) and checks the uploaded CRC32C
     blob_name = f"parquet/{os.path.basename(parquet_path)}"
-    blob = bucket.blob(blob_name)
-
-    # Delete existing parquet so upload overwrites
-    if blob.exists():
-        print(f"Deleting existing file: {blob_name}")
-        blob.delete()
 
     print(f"Uploading {blob_name}...")
-    blob.upload_from_filename(parquet_path)
-    print(f"Uploaded gs://{BUCKET_NAME}/{blob_name}")
+    if tlc_storage.sync_file(storage_backend, parquet_path, blob_name, remote):
+        print(f"Uploaded gs://{BUCKET_NAME}/{blob_name}")
+    else:
+        print(f"Unchanged, skipped gs://{BUCKET_NAME}/{blob_name}")
 
 # ================================
 # MAIN PIPELINE
 # ================================
 if __name__ == "__main__":
+    # Metadata of the existing parquet objects, fetched once for all months
+    remote = storage_backend.list("parquet/")
+
     for file_name in FHV_FILES:
         csv_path = download_file(file_name)
         parquet_path = transform_to_parquet(csv_path)
-        upload_to_gcs(parquet_path)
+        upload_to_gcs(parquet_path, remote)
 
     print("FHV 2019 ingestion complete!")
\ No newline at end of file
@@ -1,5 +1,7 @@
 from google.cloud import bigquery
 
+import taxi_schemas
+
 # ================================
 # CONFIG
 # ================================
@@ -14,15 +16,7 @@ dataset_id = f"{PROJECT_ID}.{DATASET_NAME}"
 # ================================
 # FHV SCHEMA
 # ================================
-fhv_schema = [
-    bigquery.SchemaField("dispatching_base_num", "STRING"),
-    bigquery.SchemaField("pickup_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("dropoff_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("pickup_location_id", "STRING"),
-    bigquery.SchemaField("dropoff_location_id", "STRING"),
-    bigquery.SchemaField("sr_flag", "STRING"),
-    bigquery.SchemaField("affiliated_base_number", "STRING"),
-]
+fhv_schema = taxi_schemas.bigquery_schema("fhv")
 
 # ================================
 # CREATE DATASET
@@ -1,13 +1,20 @@
 from google.cloud import storage
 import os
 import sys
-import urllib.request
+from pathlib import Path
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor
+import pyarrow.csv as pacsv
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from google.cloud import storage
 from google.api_core.exceptions import NotFound, Forbidden
 import time
-from decimal import Decimal
+
+# Shared TLC download cache lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tlc_cache
+import tlc_storage
+import taxi_schemas
 
 client = storage.Client.from_service_account_json("gcs.json")
 
@@ -22,12 +29,42 @@ PARQUET_DIR = os.path.join(DATA_DIR, "parquet")
 
 CHUNK_SIZE = 8 * 1024 * 1024
 
+# CSV parser for transform_to_parquet: "pandas" or "arrow" (multi-threaded pyarrow.csv)
+CSV_ENGINE = "pandas"
+
+# The CSV is transformed in chunks of this many rows (pandas) or bytes (arrow)
+CSV_CHUNK_ROWS = 500000
+CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+# Parquet layout (taxi_schemas.PROFILES): "scan" sorts row groups by pickup time
+# and adds page indexes and zone bloom filters so date/zone filters skip data
+PARQUET_PROFILE = "scan"
+
+# Write each parquet file straight into a resumable GCS upload instead of PARQUET_DIR
+STREAM_UPLOADS = False
+
+# Files over the threshold are uploaded as COMPOSITE_PARTS parts in parallel and composed in GCS
+COMPOSITE_THRESHOLD = 64 * 1024 * 1024
+COMPOSITE_PARTS = 8
+COMPOSITE_WORKERS = 8
+
+# Concurrency of each pipeline stage. Downloads and uploads run in threads,
+# transforms in worker processes; None sizes the transform pool from the CPU
+# count and the free memory (TRANSFORM_MEMORY per file being transformed)
+DOWNLOAD_WORKERS = 4
+TRANSFORM_WORKERS = None
+UPLOAD_WORKERS = 4
+TRANSFORM_MEMORY = 1024 ** 3
+
 os.makedirs(RAW_DIR, exist_ok = True)
 os.makedirs(PARQUET_DIR, exist_ok = True)
 
 client = storage.Client.from_service_account_json(CREDENTIALS_FILE)
 bucket = client.bucket(BUCKET_NAME)
 
+# Destination of every upload, streamed or not; tlc_storage.LocalBackend("gcs") stands in for GCS in local tests
+storage_backend = tlc_storage.GCSBackend(bucket, chunk_size = CHUNK_SIZE)
+
 # ================================
 # GENERATE URLS
 # ================================
@@ -43,175 +80,6 @@ def generate_file_urls(data_type = "yellow", start_year = 2019, end_year = 2020)
 
 ALL_FILES = generate_file_urls("yellow") + generate_file_urls("green")
 
-# ================================
-# SCHEMAS
-# ================================
-
-YELLOW_RENAME = {
-    "VendorID": "vendor_id",
-    "tpep_pickup_datetime": "pickup_datetime",
-    "tpep_dropoff_datetime": "dropoff_datetime",
-    "passenger_count": "passenger_count",
-    "trip_distance": "trip_distance",
-    "RatecodeID": "rate_code",
-    "store_and_fwd_flag": "store_and_fwd_flag",
-    "payment_type": "payment_type",
-    "fare_amount": "fare_amount",
-    "extra": "extra",
-    "mta_tax": "mta_tax",
-    "tip_amount": "tip_amount",
-    "tolls_amount": "tolls_amount",
-    "improvement_surcharge": "imp_surcharge",
-    "airport_fee": "airport_fee",
-    "total_amount": "total_amount",
-    "PULocationID": "pickup_location_id",
-    "DOLocationID": "dropoff_location_id"
-}
-
-GREEN_RENAME = {
-    "VendorID": "vendor_id",
-    "lpep_pickup_datetime": "pickup_datetime",
-    "lpep_dropoff_datetime": "dropoff_datetime",
-    "store_and_fwd_flag": "store_and_fwd_flag",
-    "RatecodeID": "rate_code",
-    "passenger_count": "passenger_count",
-    "trip_distance": "trip_distance",
-    "fare_amount": "fare_amount",
-    "extra": "extra",
-    "mta_tax": "mta_tax",
-    "tip_amount": "tip_amount",
-    "tolls_amount": "tolls_amount",
-    "ehail_fee": "ehail_fee",
-    "airport_fee": "airport_fee",
-    "total_amount": "total_amount",
-    "payment_type": "payment_type",
-    "trip_type": "trip_type",
-    "improvement_surcharge": "imp_surcharge",
-    "PULocationID": "pickup_location_id",
-    "DOLocationID": "dropoff_location_id"
-}
-
-# Full schema objects including dtypes, rename map, column order, datetime columns
-YELLOW_SCHEMA = {
-    "dtypes": {
-        "vendor_id": "string",
-        "pickup_datetime": "datetime64[ns]",
-        "dropoff_datetime": "datetime64[ns]",
-        "passenger_count": "Int64",
-        "trip_distance": "float64",
-        "rate_code": "string",
-        "store_and_fwd_flag": "string",
-        "payment_type": "string",
-        "fare_amount": "float64",
-        "extra": "float64",
-        "mta_tax": "float64",
-        "tip_amount": "float64",
-        "tolls_amount": "float64",
-        "imp_surcharge": "float64",
-        "airport_fee": "float64",
-        "total_amount": "float64",
-        "pickup_location_id": "string",
-        "dropoff_location_id": "string",
-        "data_file_year": "Int64",
-        "data_file_month": "Int64"
-    },
-    "rename_map": YELLOW_RENAME,
-    "columns": [
-        "vendor_id", "pickup_datetime", "dropoff_datetime", "passenger_count", "trip_distance",
-        "rate_code", "store_and_fwd_flag", "payment_type", "fare_amount", "extra", "mta_tax",
-        "tip_amount", "tolls_amount", "imp_surcharge", "airport_fee", "total_amount",
-        "pickup_location_id", "dropoff_location_id", "data_file_year", "data_file_month"
-    ],
-    "datetime_cols": ["pickup_datetime", "dropoff_datetime"]
-}
-
-GREEN_SCHEMA = {
-    "dtypes": {
-        "vendor_id": "string",
-        "pickup_datetime": "datetime64[ns]",
-        "dropoff_datetime": "datetime64[ns]",
-        "store_and_fwd_flag": "string",
-        "rate_code": "string",
-        "passenger_count": "Int64",
-        "trip_distance": "float64",
-        "fare_amount": "float64",
-        "extra": "float64",
-        "mta_tax": "float64",
-        "tip_amount": "float64",
-        "tolls_amount": "float64",
-        "ehail_fee": "float64",
-        "airport_fee": "float64",
-        "total_amount": "float64",
-        "payment_type": "string",
-        "distance_between_service": "float64",
-        "time_between_service": "Int64",
-        "trip_type": "string",
-        "imp_surcharge": "float64",
-        "pickup_location_id": "string",
-        "dropoff_location_id": "string",
-        "data_file_year": "Int64",
-        "data_file_month": "Int64"
-    },
-    "rename_map": GREEN_RENAME,
-    "columns": [
-        "vendor_id", "pickup_datetime", "dropoff_datetime", "store_and_fwd_flag", "rate_code",
-        "passenger_count", "trip_distance", "fare_amount", "extra", "mta_tax", "tip_amount",
-        "tolls_amount", "ehail_fee", "airport_fee", "total_amount", "payment_type",
-        "distance_between_service", "time_between_service", "trip_type", "imp_surcharge",
-        "pickup_location_id", "dropoff_location_id", "data_file_year", "data_file_month"
-    ],
-    "datetime_cols": ["pickup_datetime", "dropoff_datetime"]
-}
-
-# Define numeric columns for BigQuery NUMERIC
-NUMERIC_COLS_YELLOW = [
-    "trip_distance", "fare_amount", "extra", "mta_tax",
-    "tip_amount", "tolls_amount", "imp_surcharge",
-    "airport_fee", "total_amount"
-]
-
-NUMERIC_COLS_GREEN = NUMERIC_COLS_YELLOW + ["ehail_fee", "distance_between_service"]
-
-INTEGER_COLS_YELLOW = ["passenger_count", "data_file_year", "data_file_month"]
-
-INTEGER_COLS_GREEN = [
-    "passenger_count",
-    "time_between_service",
-    "data_file_year",
-    "data_file_month"
-]
-
-BQ_STRING_COLS_YELLOW = [
-    "vendor_id","rate_code","store_and_fwd_flag","payment_type",
-    "pickup_location_id","dropoff_location_id"
-]
-
-BQ_STRING_COLS_GREEN = [
-    "vendor_id","store_and_fwd_flag","rate_code","payment_type",
-    "trip_type","pickup_location_id","dropoff_location_id"
-]
-
-BQ_TIMESTAMP_COLS = ["pickup_datetime","dropoff_datetime"]
-
-BQ_INTEGER_COLS_YELLOW = [
-    "passenger_count","data_file_year","data_file_month"
-]
-
-BQ_INTEGER_COLS_GREEN = [
-    "passenger_count","time_between_service","data_file_year","data_file_month"
-]
-
-BQ_NUMERIC_COLS_YELLOW = [
-    "trip_distance","fare_amount","extra","mta_tax","tip_amount",
-    "tolls_amount","imp_surcharge","airport_fee","total_amount"
-]
-
-BQ_NUMERIC_COLS_GREEN = [
-    "trip_distance","fare_amount","extra","mta_tax","tip_amount",
-    "tolls_amount","ehail_fee","airport_fee","total_amount",
-    "distance_between_service","imp_surcharge"
-]
-
 # ================================
 # BUCKET CREATION
 # ================================
@@ -235,7 +103,7 @@ def download_file(file_tuple):
 
     try:
         print(f"Downloading {file_name}")
-        urllib.request.urlretrieve(url, file_path)
+        tlc_cache.fetch(url, dest = file_path)
 
         return (data_type, year, month, file_name, file_path)
 
@@ -246,111 +114,184 @@ def download_file(file_tuple):
 # ================================
 # TRANSFORM CSV TO PARQUET
 # ================================
-def transform_to_parquet(file_info):
-    data_type, year, month, file_name, csv_path = file_info
-
-    schema = YELLOW_SCHEMA if data_type == "yellow" else GREEN_SCHEMA
-
-    print(f"Transforming {file_name}")
+def read_csv_chunks(csv_path, data_type):
+    """Yield the CSV as DataFrames of about CSV_CHUNK_ROWS rows (CSV_BLOCK_SIZE bytes with the arrow engine)."""
+    if CSV_ENGINE != "arrow":
+        yield from pd.read_csv(
+            csv_path,
+            compression = "gzip",
+            dtype = taxi_schemas.read_dtypes(data_type),
+            chunksize = CSV_CHUNK_ROWS,
+            low_memory = False
+        )
+        return
+
+    # Parse each CSV column as the type its registry kind is read with
+    column_types = taxi_schemas.read_types(data_type)
+
+    convert_options = pacsv.ConvertOptions(
+        column_types = column_types,
+        include_columns = list(column_types),
+        include_missing_columns = True,
+        strings_can_be_null = True
+    )
 
-    df = pd.read_csv(csv_path, compression = "gzip", low_memory = False)
+    # Stream the gzip CSV through pyarrow's multi-threaded parser; the
+    # record batches go straight to Arrow-backed columns, no object dtype
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options = pacsv.ReadOptions(block_size = CSV_BLOCK_SIZE),
+        convert_options = convert_options
+    )
+    for batch in reader:
+        yield batch.to_pandas(types_mapper = pd.ArrowDtype)
 
-    # Rename columns
-    df = df.rename(columns = schema["rename_map"])
+def transform_to_parquet(file_info, backend = None):
+    # With a storage backend the parquet file is streamed to it, not written to PARQUET_DIR
+    data_type, year, month, file_name, csv_path = file_info
 
-    # Add metadata columns
-    df["data_file_year"] = year
-    df["data_file_month"] = month
+    print(f"Transforming {file_name}")
 
-    # Parse datetimes
-    for col in schema["datetime_cols"]:
-        df[col] = pd.to_datetime(df[col], errors = "coerce")
+    # Every chunk is renamed, converted to its BigQuery types and appended to
+    # the parquet file as it is read; memory is bounded by the chunk size
+    chunks = read_csv_chunks(csv_path, data_type)
+    constants = {"data_file_year": year, "data_file_month": month}
+    parquet_name = file_name.replace(".csv.gz", ".parquet")
 
-    # Choose correct groups
-    if data_type == "yellow":
-        string_cols = BQ_STRING_COLS_YELLOW
-        int_cols = BQ_INTEGER_COLS_YELLOW
-        numeric_cols = BQ_NUMERIC_COLS_YELLOW
+    if backend is not None:
+        blob_name = f"parquet/{parquet_name}"
+        with backend.writer(blob_name) as f:
+            rows, rounding = taxi_schemas.write_parquet(chunks, data_type, f, constants, PARQUET_PROFILE)
+        result = backend.uri(blob_name)
+        print(f"Uploaded {result}")
     else:
-        string_cols = BQ_STRING_COLS_GREEN
-        int_cols = BQ_INTEGER_COLS_GREEN
-        numeric_cols = BQ_NUMERIC_COLS_GREEN
-
-    # ---- STRING → STRING ----
-    for col in string_cols:
-        if col in df.columns:
-            df[col] = df[col].astype("string")
-
-    # ---- TIMESTAMP → TIMESTAMP ----
-    for col in BQ_TIMESTAMP_COLS:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce").astype("datetime64[us]")
-
-    # ---- INTEGER → INT64 ----
-    for col in int_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int64")
-
-    # ---- NUMERIC → DECIMAL (BigQuery NUMERIC) ----
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
-            df[col] = df[col].apply(lambda x: Decimal(str(x)) if pd.notnull(x) else None)
-
-    # Ensure all expected columns exist
-    for col in schema["dtypes"].keys():
-        if col not in df.columns:
-            df[col] = pd.NA
-
-    # 2. Convert datetime columns to true timestamp
-    for col in schema["datetime_cols"]:
-        df[col] = pd.to_datetime(df[col], errors = "coerce")
-        df[col] = df[col].astype("datetime64[us]")
-
-    # 3. Force TRUE integer columns (fix float -> int problem)
-    int_cols = INTEGER_COLS_YELLOW if data_type == "yellow" else INTEGER_COLS_GREEN
-
-    for col in int_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors = "coerce").astype("Int64")
-
-    # 4. Convert FLOAT columns to Decimal for BigQuery NUMERIC
-    numeric_cols = NUMERIC_COLS_YELLOW if data_type == "yellow" else NUMERIC_COLS_GREEN
-
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors = "coerce").astype("float64")
-            df[col] = df[col].apply(
-                lambda x: Decimal(str(x)) if pd.notnull(x) else None
+        # Written under a temporary name so an interrupted run never leaves a truncated file
+        result = os.path.join(PARQUET_DIR, parquet_name)
+        try:
+            rows, rounding = taxi_schemas.write_parquet(
+                chunks, data_type, result + ".tmp", constants, PARQUET_PROFILE
             )
+        except BaseException:
+            if os.path.exists(result + ".tmp"):
+                os.remove(result + ".tmp")
+            raise
+        os.replace(result + ".tmp", result)
 
-    # Enforce column order
-    df = df[schema["columns"]]
-
-    parquet_name = file_name.replace(".csv.gz", ".parquet")
-    parquet_path = os.path.join(PARQUET_DIR, parquet_name)
-
-    df.to_parquet(
-        parquet_path,
-        engine = "pyarrow",
-        index = False,
-        coerce_timestamps = "us",
-        allow_truncated_timestamps = True
-    )
+    for col, (rounded, overflow) in rounding.items():
+        print(f"{file_name} {col}: {rounded} values rounded to 9 decimals, "
+              f"{overflow} out of NUMERIC range set to null")
+    print(f"Transformed {file_name}: {rows} rows")
 
-    return parquet_path
+    return result
 
 # ================================
 # UPLOAD TO GCS
 # ================================
-def upload_to_gcs(file_path):
+def upload_to_gcs(file_path, remote = None):
+    # remote is the parquet/ listing taken once at the start; identical objects are skipped
     blob_name = os.path.basename(file_path)
-    blob = bucket.blob(f"parquet/{blob_name}")
-    blob.chunk_size = CHUNK_SIZE
 
     print(f"Uploading {blob_name} to GCS...")
-    blob.upload_from_filename(file_path)
-    print(f"Uploaded gs://{BUCKET_NAME}/parquet/{blob_name}")
+    parts = tlc_storage.sync_file(
+        storage_backend, file_path, f"parquet/{blob_name}", remote,
+        threshold = COMPOSITE_THRESHOLD, parts = COMPOSITE_PARTS, workers = COMPOSITE_WORKERS
+    )
+    if parts:
+        print(f"Uploaded gs://{BUCKET_NAME}/parquet/{blob_name} ({parts} part{'s' if parts > 1 else ''})")
+    else:
+        print(f"Unchanged, skipped gs://{BUCKET_NAME}/parquet/{blob_name}")
+
+# ================================
+# PIPELINE
+# ================================
+def transform_workers():
+    if TRANSFORM_WORKERS:
+        return TRANSFORM_WORKERS
+
+    cpus = os.cpu_count() or 1
+    return max(1, min(cpus, available_memory() // TRANSFORM_MEMORY))
+
+def available_memory():
+    # MemAvailable counts the page cache that can be reclaimed, unlike "free"
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError):
+        return TRANSFORM_MEMORY * (os.cpu_count() or 1)
+
+def transform_file(file_info):
+    # Runs in a worker process, which has its own client and storage_backend
+    start = time.perf_counter()
+    result = transform_to_parquet(file_info, storage_backend if STREAM_UPLOADS else None)
+    return result, time.perf_counter() - start
+
+def run_pipeline(files):
+    """Download, transform and upload every file, each moving on as soon as its previous stage is done.
+
+    Wall time is close to that of the slowest stage instead of the sum of
+    all three. Returns the number of files that failed.
+    """
+    workers = transform_workers()
+    print(f"Pipeline: {DOWNLOAD_WORKERS} downloads, {workers} transforms, {UPLOAD_WORKERS} uploads at a time")
+
+    # Metadata of the existing parquet objects, fetched once; identical files are skipped
+    remote = storage_backend.list("parquet/") if not STREAM_UPLOADS else None
+
+    # Spawned workers do not inherit the parent's open GCS connections
+    context = multiprocessing.get_context("spawn")
+    busy = {"download": 0.0, "transform": 0.0, "upload": 0.0}
+    failed = 0
+    start = time.perf_counter()
+
+    def timed(stage, func, *args):
+        stage_start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            busy[stage] += time.perf_counter() - stage_start
+
+    with ThreadPoolExecutor(max_workers = DOWNLOAD_WORKERS) as downloads, \
+         ProcessPoolExecutor(max_workers = workers, mp_context = context) as transforms, \
+         ThreadPoolExecutor(max_workers = UPLOAD_WORKERS) as uploads:
+
+        pending = {downloads.submit(timed, "download", download_file, file): ("download", file[3]) for file in files}
+
+        while pending:
+            done, _ = wait(pending, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                stage, file_name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"{stage.capitalize()} failed: {file_name} {e}")
+                    failed += 1
+                    continue
+
+                if stage == "download":
+                    if result is None:
+                        # download_file already reported it
+                        failed += 1
+                        continue
+                    pending[transforms.submit(transform_file, result)] = ("transform", file_name)
+                elif stage == "transform":
+                    result, elapsed = result
+                    busy["transform"] += elapsed
+                    if not STREAM_UPLOADS:
+                        pending[uploads.submit(timed, "upload", upload_to_gcs, result, remote)] = ("upload", file_name)
+
+    print(
+        f"Pipeline finished in {time.perf_counter() - start:.1f}s "
+        f"(summed stage time: download {busy['download']:.1f}s, transform {busy['transform']:.1f}s, "
+        f"upload {busy['upload']:.1f}s); {failed} file(s) failed"
+    )
+    return failed
 
 # ================================
 # MAIN PIPELINE
@@ -358,17 +299,8 @@ def upload_to_gcs(file_path):
 if __name__ == "__main__":
     create_bucket(BUCKET_NAME)
 
-    # 1 Download
-    with ThreadPoolExecutor(max_workers = 4) as executor:
-        downloads = list(executor.map(download_file, ALL_FILES))
-    downloads = [d for d in downloads if d]
-
-    # 2 Transform
-    with ThreadPoolExecutor(max_workers = 4) as executor:
-        parquet_files = list(executor.map(transform_to_parquet, downloads))
-
-    # 3 Upload
-    with ThreadPoolExecutor(max_workers = 4) as executor:
-        executor.map(upload_to_gcs, parquet_files)
+    failed = run_pipeline(ALL_FILES)
+    if failed:
+        sys.exit(1)
 
-    print("Pipeline complete!")
\ No newline at end of file
+    print("Pipeline complete!")
@@ -1,5 +1,7 @@
 from google.cloud import bigquery
 
+import taxi_schemas
+
 # ================================
 # CONFIG
 # ================================
@@ -16,55 +18,9 @@ client = bigquery.Client.from_service_account_json(
 # ================================
 # SCHEMAS
 # ================================
-green_schema = [
-    bigquery.SchemaField("vendor_id", "STRING"),
-    bigquery.SchemaField("pickup_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("dropoff_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("store_and_fwd_flag", "STRING"),
-    bigquery.SchemaField("rate_code", "STRING"),
-    bigquery.SchemaField("passenger_count", "INT64"),
-    bigquery.SchemaField("trip_distance", "NUMERIC"),
-    bigquery.SchemaField("fare_amount", "NUMERIC"),
-    bigquery.SchemaField("extra", "NUMERIC"),
-    bigquery.SchemaField("mta_tax", "NUMERIC"),
-    bigquery.SchemaField("tip_amount", "NUMERIC"),
-    bigquery.SchemaField("tolls_amount", "NUMERIC"),
-    bigquery.SchemaField("ehail_fee", "NUMERIC"),
-    bigquery.SchemaField("airport_fee", "NUMERIC"),
-    bigquery.SchemaField("total_amount", "NUMERIC"),
-    bigquery.SchemaField("payment_type", "STRING"),
-    bigquery.SchemaField("distance_between_service", "NUMERIC"),
-    bigquery.SchemaField("time_between_service", "INT64"),
-    bigquery.SchemaField("trip_type", "STRING"),
-    bigquery.SchemaField("imp_surcharge", "NUMERIC"),
-    bigquery.SchemaField("pickup_location_id", "STRING"),
-    bigquery.SchemaField("dropoff_location_id", "STRING"),
-    bigquery.SchemaField("data_file_year", "INT64"),
-    bigquery.SchemaField("data_file_month", "INT64"),
-]
-
-yellow_schema = [
-    bigquery.SchemaField("vendor_id", "STRING"),
-    bigquery.SchemaField("pickup_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("dropoff_datetime", "TIMESTAMP"),
-    bigquery.SchemaField("passenger_count", "INT64"),
-    bigquery.SchemaField("trip_distance", "NUMERIC"),
-    bigquery.SchemaField("rate_code", "STRING"),
-    bigquery.SchemaField("store_and_fwd_flag", "STRING"),
-    bigquery.SchemaField("payment_type", "STRING"),
-    bigquery.SchemaField("fare_amount", "NUMERIC"),
-    bigquery.SchemaField("extra", "NUMERIC"),
-    bigquery.SchemaField("mta_tax", "NUMERIC"),
-    bigquery.SchemaField("tip_amount", "NUMERIC"),
-    bigquery.SchemaField("tolls_amount", "NUMERIC"),
-    bigquery.SchemaField("imp_surcharge", "NUMERIC"),
-    bigquery.SchemaField("airport_fee", "NUMERIC"),
-    bigquery.SchemaField("total_amount", "NUMERIC"),
-    bigquery.SchemaField("pickup_location_id", "STRING"),
-    bigquery.SchemaField("dropoff_location_id", "STRING"),
-    bigquery.SchemaField("data_file_year", "INT64"),
-    bigquery.SchemaField("data_file_month", "INT64"),
-]
+green_schema = taxi_schemas.bigquery_schema("green")
+
+yellow_schema = taxi_schemas.bigquery_schema("yellow")
 
 dataset_id = f"{PROJECT_ID}.{DATASET_NAME}"
 
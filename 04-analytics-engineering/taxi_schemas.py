@@ -0,0 +1,383 @@
+"""
+Column registry for the yellow, green and FHV parquet files.
+
+Every dataset is one list of (column, source column, kind). The source is
+the CSV header the column is read from, or None for columns that do not
+come from the CSV (data_file_year/month, filled in per file). The kind
+decides everything else about the column:
+
+    string      STRING     pa.string()
+    timestamp   TIMESTAMP  pa.timestamp("us")
+    integer     INT64      pa.int64()          (read as float: the CSVs write "1.0")
+    numeric     NUMERIC    pa.decimal128(38, 9)    (read as text and parsed exactly)
+
+From it come the parquet schema (arrow_schema), the BigQuery load schema
+(bigquery_schema), the CSV read types (read_types for pyarrow.csv,
+read_dtypes for pandas) and the conversion plan (conversion_plan), which
+convert() runs in one pass: each column is converted once, straight to its
+Arrow type. write_parquet streams CSV chunks through convert() into one
+parquet file, so a whole month is never in memory, with the row groups,
+sort order, compression, dictionaries, page indexes and bloom filters of
+one of the PROFILES.
+
+    import taxi_schemas
+    table, rounding = taxi_schemas.convert(df, "yellow", {"data_file_year": 2019, "data_file_month": 1})
+"""
+
+from decimal import Context, Decimal
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# BigQuery NUMERIC: 38 digits, 9 after the point, so at most 29 before it
+BQ_NUMERIC = pa.decimal128(38, 9)
+# Wide enough to hold what the CSVs write before it is rounded and range-checked
+WIDE_NUMERIC = pa.decimal256(76, 38)
+BQ_QUANTUM = Decimal(1).scaleb(-9)
+WIDE_CONTEXT = Context(prec = 76)
+BQ_NUMERIC_LIMIT = pa.scalar(Decimal(10) ** 29, WIDE_NUMERIC)
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+# ================================
+# KINDS
+# ================================
+KINDS = {
+    "string": {"arrow": pa.string(), "bigquery": "STRING", "read": pa.string()},
+    "timestamp": {"arrow": pa.timestamp("us"), "bigquery": "TIMESTAMP", "read": pa.timestamp("us")},
+    "integer": {"arrow": pa.int64(), "bigquery": "INT64", "read": pa.float64()},
+    "numeric": {"arrow": BQ_NUMERIC, "bigquery": "NUMERIC", "read": pa.string()}
+}
+
+# ================================
+# DATASETS
+# ================================
+FILE_COLUMNS = [
+    ("data_file_year", None, "integer"),
+    ("data_file_month", None, "integer")
+]
+
+DATASETS = {
+    "yellow": [
+        ("vendor_id", "VendorID", "string"),
+        ("pickup_datetime", "tpep_pickup_datetime", "timestamp"),
+        ("dropoff_datetime", "tpep_dropoff_datetime", "timestamp"),
+        ("passenger_count", "passenger_count", "integer"),
+        ("trip_distance", "trip_distance", "numeric"),
+        ("rate_code", "RatecodeID", "string"),
+        ("store_and_fwd_flag", "store_and_fwd_flag", "string"),
+        ("payment_type", "payment_type", "string"),
+        ("fare_amount", "fare_amount", "numeric"),
+        ("extra", "extra", "numeric"),
+        ("mta_tax", "mta_tax", "numeric"),
+        ("tip_amount", "tip_amount", "numeric"),
+        ("tolls_amount", "tolls_amount", "numeric"),
+        ("imp_surcharge", "improvement_surcharge", "numeric"),
+        ("airport_fee", "airport_fee", "numeric"),
+        ("total_amount", "total_amount", "numeric"),
+        ("pickup_location_id", "PULocationID", "string"),
+        ("dropoff_location_id", "DOLocationID", "string")
+    ] + FILE_COLUMNS,
+    "green": [
+        ("vendor_id", "VendorID", "string"),
+        ("pickup_datetime", "lpep_pickup_datetime", "timestamp"),
+        ("dropoff_datetime", "lpep_dropoff_datetime", "timestamp"),
+        ("store_and_fwd_flag", "store_and_fwd_flag", "string"),
+        ("rate_code", "RatecodeID", "string"),
+        ("passenger_count", "passenger_count", "integer"),
+        ("trip_distance", "trip_distance", "numeric"),
+        ("fare_amount", "fare_amount", "numeric"),
+        ("extra", "extra", "numeric"),
+        ("mta_tax", "mta_tax", "numeric"),
+        ("tip_amount", "tip_amount", "numeric"),
+        ("tolls_amount", "tolls_amount", "numeric"),
+        ("ehail_fee", "ehail_fee", "numeric"),
+        ("airport_fee", "airport_fee", "numeric"),
+        ("total_amount", "total_amount", "numeric"),
+        ("payment_type", "payment_type", "string"),
+        ("distance_between_service", "distance_between_service", "numeric"),
+        ("time_between_service", "time_between_service", "integer"),
+        ("trip_type", "trip_type", "string"),
+        ("imp_surcharge", "improvement_surcharge", "numeric"),
+        ("pickup_location_id", "PULocationID", "string"),
+        ("dropoff_location_id", "DOLocationID", "string")
+    ] + FILE_COLUMNS,
+    "fhv": [
+        ("dispatching_base_num", "dispatching_base_num", "string"),
+        ("pickup_datetime", "pickup_datetime", "timestamp"),
+        ("dropoff_datetime", "dropOff_datetime", "timestamp"),
+        ("pickup_location_id", "PUlocationID", "string"),
+        ("dropoff_location_id", "DOlocationID", "string"),
+        ("sr_flag", "SR_Flag", "string"),
+        ("affiliated_base_number", "Affiliated_base_number", "string")
+    ]
+}
+
+# ================================
+# DERIVED SCHEMAS
+# ================================
+@lru_cache(maxsize = None)
+def arrow_schema(dataset):
+    return pa.schema([(name, KINDS[kind]["arrow"]) for name, _, kind in DATASETS[dataset]])
+
+def bigquery_schema(dataset):
+    # Imported here so the parquet loaders do not need the BigQuery client
+    from google.cloud import bigquery
+    return [bigquery.SchemaField(name, KINDS[kind]["bigquery"]) for name, _, kind in DATASETS[dataset]]
+
+def read_types(dataset):
+    # pyarrow.csv column types, keyed by CSV header
+    return {source: KINDS[kind]["read"] for _, source, kind in DATASETS[dataset] if source is not None}
+
+def read_dtypes(dataset):
+    # pandas.read_csv dtypes: string columns are kept as written, so a chunk
+    # with no missing values cannot turn "1.0" into "1", and numeric columns
+    # too, so they never pass through float (the others are inferred)
+    return {
+        source: "string" for _, source, kind in DATASETS[dataset]
+        if source is not None and kind in ("string", "numeric")
+    }
+
+# ================================
+# CONVERSIONS
+# ================================
+# Each takes the column as read (numpy- or Arrow-backed pandas) and returns
+# an Arrow array of the kind's type, plus (rounded, overflow) counts or None
+def to_string(series):
+    return pa.array(series.astype("string"), from_pandas = True).cast(pa.string()), None
+
+def to_timestamp(series):
+    values = pd.to_datetime(series, errors = "coerce").astype("datetime64[us]")
+    return pa.array(values, from_pandas = True), None
+
+def to_integer(series):
+    return pa.array(pd.to_numeric(series, errors = "coerce").astype("Int64"), from_pandas = True), None
+
+def to_numeric(series):
+    """decimal128(38, 9) parsed from the CSV text, with the number of values
+    rounded to 9 decimals and the number out of range (or not a number) set to null."""
+    text = pc.utf8_trim_whitespace(pa.array(series, from_pandas = True).cast(pa.string()))
+    text = pc.if_else(pc.equal(text, ""), None, text)
+
+    # Exact, and the usual case: every value has at most 9 decimals and fits
+    try:
+        return pc.cast(text, BQ_NUMERIC), None
+    except pa.ArrowInvalid:
+        pass
+
+    valid = pc.match_substring_regex(text, NUMBER_PATTERN)
+    overflow = pc.sum(pc.invert(valid)).as_py() or 0
+    text = pc.if_else(valid, text, None)
+
+    try:
+        exact = pc.cast(text, WIDE_NUMERIC)
+    except pa.ArrowInvalid:
+        # More than 38 digits on either side of the point: parse one value at a time
+        decimals, rounded, too_wide = parse_decimals(text)
+        return decimals, (rounded, overflow + too_wide)
+
+    in_range = pc.less(pc.abs(exact), BQ_NUMERIC_LIMIT)
+    overflow += pc.sum(pc.invert(in_range)).as_py() or 0
+    exact = pc.if_else(in_range, exact, None)
+
+    decimals = pc.round(exact, ndigits = 9)
+    rounded = pc.sum(pc.not_equal(decimals, exact)).as_py() or 0
+
+    return pc.cast(decimals, BQ_NUMERIC), (rounded, overflow)
+
+def parse_decimals(text):
+    # The same as the vectorized path, with Python's Decimal (half to even as well)
+    values = []
+    rounded = 0
+    overflow = 0
+    for value in text.to_pylist():
+        number = None if value is None else Decimal(value)
+        if number is not None and abs(number) >= 10 ** 29:
+            number = None
+            overflow += 1
+        if number is not None:
+            quantized = number.quantize(BQ_QUANTUM, context = WIDE_CONTEXT)
+            rounded += quantized != number
+            number = quantized
+        values.append(number)
+    return pa.array(values, BQ_NUMERIC), rounded, overflow
+
+CONVERTERS = {
+    "string": to_string,
+    "timestamp": to_timestamp,
+    "integer": to_integer,
+    "numeric": to_numeric
+}
+
+@lru_cache(maxsize = None)
+def conversion_plan(dataset):
+    # One step per output column, in output order: (name, source, Arrow type, converter)
+    return tuple(
+        (name, source, KINDS[kind]["arrow"], CONVERTERS[kind])
+        for name, source, kind in DATASETS[dataset]
+    )
+
+def convert(df, dataset, constants = None):
+    """Convert a frame read from a TLC CSV into an Arrow table of arrow_schema(dataset).
+
+    df can still carry the CSV headers; columns the file does not have are
+    written as nulls. constants fills the columns without a source (one
+    value for every row).
+
+    Returns:
+      (table, {column: (rounded, overflow)} for numeric columns where either is nonzero)
+    """
+    constants = constants or {}
+    arrays = []
+    rounding = {}
+
+    for name, source, arrow_type, converter in conversion_plan(dataset):
+        column = source if source in df.columns else name
+
+        if source is None and name in constants:
+            arrays.append(pa.repeat(pa.scalar(constants[name], arrow_type), len(df)))
+        elif column in df.columns:
+            values, counts = converter(df[column])
+            arrays.append(values)
+            if counts and any(counts):
+                rounding[name] = counts
+        else:
+            arrays.append(pa.nulls(len(df), arrow_type))
+
+    return pa.Table.from_arrays(arrays, schema = arrow_schema(dataset)), rounding
+
+# ================================
+# PARQUET WRITER PROFILES
+# ================================
+# Nearly every value is distinct: a dictionary would only overflow and fall
+# back to plain pages. Every other column (ids, flags, zones, the money
+# columns' repeated amounts) is dictionary-encoded.
+NEAR_UNIQUE = ["pickup_datetime", "dropoff_datetime"]
+
+# ~265 zones; a bloom filter sized for them answers "is zone X in this row group"
+ZONE_BLOOM_FILTER = {"ndv": 300, "fpp": 0.01}
+
+# How write_parquet lays out a file. Row groups are filled to row_group_rows
+# (across CSV chunks) and sorted by sort_by before they are written, so their
+# min/max statistics and page indexes let readers skip row groups and pages
+# outside a date range; the bloom filters do the same for zones.
+PROFILES = {
+    # pyarrow defaults: one row group per CSV chunk, snappy, no indexes
+    "default": {},
+    "fast": {
+        "row_group_rows": 1000000,
+        "compression": "snappy",
+        "no_dictionary": NEAR_UNIQUE,
+        "page_index": True
+    },
+    # Date-filtered scans (BigQuery external tables, Spark, DuckDB)
+    "scan": {
+        "row_group_rows": 500000,
+        "sort_by": ["pickup_datetime"],
+        "compression": "zstd",
+        "compression_level": 3,
+        "no_dictionary": NEAR_UNIQUE,
+        "page_index": True,
+        "bloom_filters": {"pickup_location_id": ZONE_BLOOM_FILTER}
+    },
+    # Zone-filtered scans: each row group is ordered by zone, then time
+    "zone": {
+        "row_group_rows": 500000,
+        "sort_by": ["pickup_location_id", "pickup_datetime"],
+        "compression": "zstd",
+        "compression_level": 3,
+        "no_dictionary": NEAR_UNIQUE,
+        "page_index": True,
+        "bloom_filters": {"pickup_location_id": ZONE_BLOOM_FILTER}
+    },
+    # Smallest files, for data that is rarely read
+    "archive": {
+        "row_group_rows": 2000000,
+        "compression": "zstd",
+        "compression_level": 9,
+        "no_dictionary": NEAR_UNIQUE
+    }
+}
+
+def writer_options(dataset, profile):
+    """ParquetWriter keyword arguments, sort keys and row group size for a profile.
+
+    Columns a profile names that the dataset does not have are ignored.
+    """
+    settings = PROFILES[profile]
+    names = {name for name, _, _ in DATASETS[dataset]}
+
+    options = {
+        "compression": settings.get("compression", "snappy"),
+        "compression_level": settings.get("compression_level"),
+        "write_statistics": True,
+        "write_page_index": settings.get("page_index", False)
+    }
+    if "no_dictionary" in settings:
+        options["use_dictionary"] = [
+            name for name, _, _ in DATASETS[dataset] if name not in settings["no_dictionary"]
+        ]
+    if "bloom_filters" in settings:
+        options["bloom_filter_options"] = {
+            name: bloom for name, bloom in settings["bloom_filters"].items() if name in names
+        }
+
+    sort_keys = [(name, "ascending") for name in settings.get("sort_by", []) if name in names]
+    if sort_keys:
+        # Recorded in every row group's metadata, so readers know the order
+        options["sorting_columns"] = pq.SortingColumn.from_ordering(arrow_schema(dataset), sort_keys)
+
+    return options, sort_keys, settings.get("row_group_rows")
+
+def write_parquet(chunks, dataset, where, constants = None, profile = "default"):
+    """Convert each frame in chunks and append it to one parquet file.
+
+    where is a path or a binary file object. Converted chunks are buffered
+    until they fill a row group of the profile (at most one row group plus
+    one chunk is in memory), sorted and written.
+
+    Returns:
+      (rows written, {column: (rounded, overflow)} summed over the chunks)
+    """
+    options, sort_keys, row_group_rows = writer_options(dataset, profile)
+    rows = 0
+    rounding = {}
+    pending = []
+
+    def flush(writer, final):
+        table = pa.concat_tables(pending)
+        pending.clear()
+
+        # Only whole row groups are written until the last chunk is in
+        size = table.num_rows if final or not row_group_rows else table.num_rows - table.num_rows % row_group_rows
+        if not size:
+            pending.append(table)
+            return
+
+        if sort_keys:
+            # The earliest rows of the buffer are written, the rest wait for the next chunk
+            table = table.sort_by(sort_keys)
+        if size < table.num_rows:
+            pending.append(table.slice(size))
+        writer.write_table(table.slice(0, size), row_group_size = row_group_rows)
+
+    with pq.ParquetWriter(where, arrow_schema(dataset), **options) as writer:
+        for df in chunks:
+            table, chunk_rounding = convert(df, dataset, constants)
+            del df
+            pending.append(table)
+            rows += table.num_rows
+
+            for name, (rounded, overflow) in chunk_rounding.items():
+                total_rounded, total_overflow = rounding.get(name, (0, 0))
+                rounding[name] = (total_rounded + rounded, total_overflow + overflow)
+
+            if not row_group_rows or sum(t.num_rows for t in pending) >= row_group_rows:
+                flush(writer, final = False)
+
+        if pending:
+            flush(writer, final = True)
+
+    return rows, rounding
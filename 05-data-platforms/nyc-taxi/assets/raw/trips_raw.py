@@ -4,7 +4,7 @@ type: python
 image: python:3.11
 connection: duckdb-nyc-taxi
 description: |
-  Ingests NYC taxi trip data from HTTP parquet files using Python requests library.
+  Ingests NYC taxi trip data from HTTP parquet files through the shared tlc_cache download cache.
   Loops through all months between interval start/end dates and combines the data.
   Uses Bruin Python materialization with append strategy - returns a Pandas DataFrame and Bruin automatically
   appends the data to the DuckDB table. Deduplication is handled downstream in the staging layer.
@@ -94,12 +94,17 @@ columns:
 @bruin"""
 
 import pandas as pd
-import requests
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-import io
+from pathlib import Path
 import os
+import sys
 import json
+import urllib.error
+
+# Shared TLC download cache lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parents[4]))
+import tlc_cache
 
 
 def generate_month_range(start_date: str, end_date: str) -> list[tuple[int, int]]:
@@ -158,10 +163,8 @@ def materialize():
       url = f'{base_url}/{taxi_type}_tripdata_{year}-{month:02d}.parquet'
 
       try:
-        response = requests.get(url, timeout=300)
-        response.raise_for_status()
-
-        df = pd.read_parquet(io.BytesIO(response.content))
+        # Months already in the local cache are read from disk
+        df = pd.read_parquet(tlc_cache.fetch(url))
 
         # Normalize column names to lowercase with underscores to avoid collisions
         # e.g., 'Airport_fee' and 'airport_fee' both become 'airport_fee'
@@ -173,7 +176,7 @@ def materialize():
         all_dataframes.append(df)
         print(f"Successfully downloaded {year}-{month:02d}: {len(df)} rows")
 
-      except requests.exceptions.RequestException as e:
+      except (urllib.error.URLError, tlc_cache.CacheError) as e:
         error_msg = f"Error downloading {taxi_type} {year}-{month:02d}: {e}"
         print(error_msg)
         errors.append(error_msg)
@@ -6,6 +6,9 @@ YEAR=$2       # e.g., 2020
 
 URL_PREFIX="https://github.com/DataTalksClub/nyc-tlc-data/releases/download"
 
+# Files come from the shared TLC cache, so months we already have are not downloaded again
+TLC_CACHE="$(cd "$(dirname "$0")/.." && pwd)/tlc_cache.py"
+
 for MONTH in {1..12}; do
   FMONTH=$(printf "%02d" "${MONTH}")
 
@@ -16,5 +19,5 @@ for MONTH in {1..12}; do
 
   echo "downloading ${URL} to ${LOCAL_PATH}"
   mkdir -p ${LOCAL_PREFIX}
-  wget ${URL} -O ${LOCAL_PATH}
+  python "${TLC_CACHE}" "${URL}" "${LOCAL_PATH}"
 done
\ No newline at end of file
@@ -1,12 +1,19 @@
+import sys
+from pathlib import Path
+
 import pandas as pd
 
+# Shared TLC download cache lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tlc_cache
+
 # Load the Parquet data
 url = "https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2025-10.parquet"
 columns = [
     'lpep_pickup_datetime',
     'tip_amount'
 ]
-df = pd.read_parquet(url, columns=columns)
+df = pd.read_parquet(tlc_cache.fetch(url), columns=columns)
 
 # Convert pickup time to datetime
 df['lpep_pickup_datetime'] = pd.to_datetime(df['lpep_pickup_datetime'])
@@ -5,15 +5,17 @@ import time
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
 
 import pandas as pd
 from kafka import KafkaProducer
 from models import Ride, ride_from_row
+import tlc_cache
 
 # Download NYC yellow taxi trip data (first 1000 rows)
 url = "https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_2025-11.parquet"
 columns = ['PULocationID', 'DOLocationID', 'trip_distance', 'total_amount', 'tpep_pickup_datetime']
-df = pd.read_parquet(url, columns=columns).head(1000)
+df = pd.read_parquet(tlc_cache.fetch(url), columns=columns).head(1000)
 
 def ride_serializer(ride):
     ride_dict = dataclasses.asdict(ride)
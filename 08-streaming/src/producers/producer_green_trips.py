@@ -5,9 +5,11 @@ from pathlib import Path
 import math
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
 
 import pandas as pd
 from kafka import KafkaProducer
+import tlc_cache
 
 # Load green trips data
 url = "https://d37ci6vzurychx.cloudfront.net/trip-data/green_tripdata_2025-10.parquet"
@@ -21,7 +23,7 @@ columns = [
     'tip_amount',
     'total_amount'
 ]
-df = pd.read_parquet(url, columns=columns)
+df = pd.read_parquet(tlc_cache.fetch(url), columns=columns)
 
 # Replace all NaNs with None for valid JSON
 df = df.where(pd.notnull(df), None)
@@ -0,0 +1,328 @@
+"""
+Local cache for the public NYC TLC source files, shared by every module.
+
+Files are keyed by URL and stored under TLC_CACHE_DIR (default ~/.cache/tlc)
+next to a small JSON sidecar holding the ETag, Last-Modified, size and
+sha256 of the body. A cached file is served without touching the network;
+pass revalidate = True to send a conditional request instead, which only
+downloads again if the server copy changed. Downloads go to a temporary file
+and are renamed into place once the size (and hash, if given) check out.
+The cache is capped at TLC_CACHE_MAX_BYTES and evicts the least recently
+used files first; unfinished downloads a downloader keeps for resuming
+count toward the cap and are evicted the same way.
+
+Usage from Python:
+
+    import tlc_cache
+    path = tlc_cache.fetch(url)                        # path inside the cache
+    path = tlc_cache.fetch(url, dest = "data/x.csv.gz")  # linked/copied to dest
+
+and from the shell:
+
+    python tlc_cache.py URL [DEST]
+"""
+
+import email.utils
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+CACHE_DIR = os.environ.get("TLC_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tlc"))
+MAX_CACHE_BYTES = int(os.environ.get("TLC_CACHE_MAX_BYTES", 50 * 1024 ** 3))
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class CacheError(Exception):
+    """A download did not match the expected size or hash."""
+
+
+def cache_paths(url, cache_dir = None):
+    """Return (data path, metadata path) for url inside the cache."""
+    cache_dir = cache_dir or CACHE_DIR
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    # Keep the original file name at the end so cached files are recognisable
+    name = os.path.basename(urllib.parse.urlparse(url).path) or "index"
+    data_path = os.path.join(cache_dir, key[:2], f"{key[:16]}-{name}")
+    return data_path, data_path + ".json"
+
+
+def read_metadata(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_metadata(meta_path, meta):
+    # Write then rename so readers never see a half-written sidecar
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(meta_path), suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+
+def stream_download(response, tmp_path):
+    """Default body writer: copy the HTTP response to tmp_path."""
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_complete(data_path, meta):
+    return meta is not None and os.path.exists(data_path) and os.path.getsize(data_path) == meta["size"]
+
+
+def conditional_request(url, meta, method = "GET"):
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return urllib.request.Request(url, headers = headers, method = method)
+
+
+def download(url, data_path, meta, sha256 = None, downloader = None):
+    """Download url into the cache unless the server says our copy is current.
+
+    Returns the metadata of the cached file.
+    """
+    # A custom downloader fetches the body itself, so only ask for the headers
+    method = "GET" if downloader is None else "HEAD"
+    request = conditional_request(url, meta if is_complete(data_path, meta) else None, method)
+
+    try:
+        response = urllib.request.urlopen(request, timeout = 300)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return meta
+        raise
+
+    with response:
+        expected_size = response.headers.get("Content-Length")
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(data_path), suffix = ".part")
+        os.close(fd)
+
+        try:
+            if downloader is None:
+                stream_download(response, tmp_path)
+            else:
+                downloader(url, tmp_path)
+
+            size = os.path.getsize(tmp_path)
+            if expected_size is not None and size != int(expected_size):
+                raise CacheError(f"{url}: expected {expected_size} bytes, got {size}")
+
+            digest = file_sha256(tmp_path)
+            if sha256 is not None and digest != sha256:
+                raise CacheError(f"{url}: sha256 mismatch ({digest} != {sha256})")
+
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    return {
+        "url": url,
+        "size": size,
+        "sha256": digest,
+        "etag": etag,
+        "last_modified": last_modified,
+        "downloaded_at": email.utils.formatdate(usegmt = True)
+    }
+
+
+def lock_entry(data_path):
+    """Open and lock the per-URL lock file, held while the entry is read or changed."""
+    lock_path = data_path + ".lock"
+    while True:
+        lock_file = open(lock_path, "w")
+        if fcntl is None:
+            return lock_file
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Eviction may have deleted the file while we waited; lock the new one then
+        try:
+            if os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino:
+                return lock_file
+        except FileNotFoundError:
+            pass
+        lock_file.close()
+
+
+def partial_entry(partial_path, cache_dir):
+    """(last access, data path, paths, size) of a download a downloader left unfinished.
+
+    tlc_download keeps name.partial and name.partial.state next to the
+    temporary file, so an interrupted download can be resumed; they count
+    toward the cache size like any entry. The state names the URL, whose
+    entry lock is held while they are used.
+    """
+    state_path = partial_path + ".state"
+    state = read_metadata(state_path)
+    data_path = cache_paths(state["url"], cache_dir)[0] if state and "url" in state else None
+
+    paths = [partial_path, state_path]
+    # The lock file goes too, unless it also belongs to a cached copy of the URL
+    if data_path is not None and not os.path.exists(data_path + ".json"):
+        paths.append(data_path + ".lock")
+
+    size = sum(os.path.getsize(path) for path in (partial_path, state_path) if os.path.exists(path))
+    return os.path.getmtime(partial_path), data_path, paths, size
+
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def remove_locked(lock_path, paths):
+    """Delete paths under the entry lock; False if another process holds it."""
+    with open(lock_path, "w") as lock_file:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+        remove_files(paths)
+    return True
+
+
+def evict(cache_dir = None, max_bytes = None, keep = ()):
+    """Delete least recently used files (and their lock files) until the cache fits in max_bytes."""
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = MAX_CACHE_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".json"):
+                meta = read_metadata(path)
+                if meta is not None:
+                    data_path = path[:-len(".json")]
+                    entries.append((meta.get("last_access", 0), data_path, [data_path, path, data_path + ".lock"], meta["size"]))
+            elif name.endswith(".partial"):
+                try:
+                    entries.append(partial_entry(path, cache_dir))
+                except FileNotFoundError:
+                    # Finished (renamed into place) while we looked
+                    pass
+
+    total = sum(size for _, _, _, size in entries)
+
+    for _, data_path, paths, size in sorted(entries, key = lambda entry: entry[0]):
+        if total <= max_bytes:
+            break
+        if data_path in keep:
+            continue
+        if data_path is None:
+            # A partial download without a readable state has no entry lock to take
+            remove_files(paths)
+        elif not remove_locked(data_path + ".lock", paths):
+            # Another process is fetching it right now
+            continue
+        total -= size
+        print(f"Evicted {os.path.basename(paths[0])} from the TLC cache")
+
+
+def link_or_copy(src, dest):
+    os.makedirs(os.path.dirname(dest) or ".", exist_ok = True)
+    if os.path.exists(dest):
+        if os.path.samefile(src, dest):
+            return
+        os.remove(dest)
+    try:
+        # A hard link costs no extra disk space and survives eviction
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+def fetch(url, dest = None, revalidate = False, sha256 = None, as_mmap = False,
+          cache_dir = None, max_bytes = None, downloader = None):
+    """Return a local copy of url, downloading it only if it is not cached.
+
+    Args:
+      url: Source URL; also the cache key.
+      dest: Optional path to hard link (or copy) the cached file to.
+      revalidate: Ask the server (ETag / Last-Modified) whether a cached copy is stale.
+      sha256: Expected hex digest of the body; checked before the file enters the cache,
+        and a cached copy with a different digest is downloaded again.
+      as_mmap: Return a read-only mmap of the file instead of a path.
+      cache_dir, max_bytes: Override TLC_CACHE_DIR / TLC_CACHE_MAX_BYTES.
+      downloader: Callable (url, path) that writes the body to path, used
+        instead of a single streaming GET.
+
+    Returns:
+      The cached path (or dest), or an mmap.mmap when as_mmap is set.
+    """
+    data_path, meta_path = cache_paths(url, cache_dir)
+    os.makedirs(os.path.dirname(data_path), exist_ok = True)
+
+    # One process at a time per URL; others wait and then hit the cache
+    with lock_entry(data_path):
+        meta = read_metadata(meta_path)
+
+        # A copy with the wrong digest is no use, even if the server says it is current
+        if meta is not None and sha256 is not None and meta.get("sha256") != sha256:
+            print(f"Cached copy of {url} does not match sha256 {sha256}")
+            meta = None
+
+        if is_complete(data_path, meta) and not revalidate:
+            print(f"Cache hit: {url}")
+        else:
+            previous = meta
+            meta = download(url, data_path, meta, sha256, downloader)
+            print(f"{'Revalidated' if meta is previous else 'Downloaded'}: {url}")
+
+        meta["last_access"] = time.time()
+        write_metadata(meta_path, meta)
+
+        # Still under the lock, so another process cannot evict the file first
+        result = data_path
+        if dest is not None:
+            link_or_copy(data_path, dest)
+            result = dest
+
+        if as_mmap:
+            # The mapping stays valid even if the file is evicted later
+            with open(result, "rb") as f:
+                result = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+    evict(cache_dir, max_bytes, keep = {data_path})
+
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("usage: python tlc_cache.py URL [DEST]")
+        sys.exit(2)
+
+    print(fetch(sys.argv[1], *sys.argv[2:]))
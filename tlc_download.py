@@ -0,0 +1,223 @@
+"""
+Parallel, resumable HTTP downloader for the large TLC source files.
+
+A file is split into byte ranges (PART_SIZE each) that are fetched over
+several connections at once and written in place into a preallocated
+partial file. Finished parts are recorded in a small state file next to
+it, so an interrupted download picks up where it stopped, as long as the
+server still reports the same size and ETag. At the end the length is
+checked and, when the ETag is a plain MD5 (single-part S3 / CloudFront
+objects), the MD5 of the body as well. Servers without range support get
+a single streaming GET.
+
+One RangeDownloader is meant to be shared by all the threads downloading
+files: its connection cap and bandwidth limit apply to all of them
+together. It plugs into the cache as its downloader:
+
+    import tlc_cache, tlc_download
+    downloader = tlc_download.RangeDownloader(connections = 4, max_connections = 8)
+    tlc_cache.fetch(url, dest = "data/x.parquet", downloader = downloader)
+
+and from the shell (e.g. against a local test server):
+
+    python tlc_download.py URL DEST [CONNECTIONS] [MAX_MB_PER_SECOND]
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+PART_SIZE = 16 * 1024 * 1024
+READ_SIZE = 256 * 1024
+
+
+class DownloadError(Exception):
+    """The server sent something other than the bytes asked for."""
+
+
+def read_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_state(state_path, state):
+    # Write then rename so a crash never leaves a half-written state file
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(state_path), suffix = ".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(PART_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class RangeDownloader:
+    """Callable (url, path) that downloads url to path with parallel range requests.
+
+    Args:
+      part_size: Bytes per range request.
+      connections: Concurrent range requests per file.
+      max_connections: Concurrent requests across every file being downloaded.
+      max_bytes_per_second: Combined bandwidth limit, or None for no limit.
+      retries: Attempts per part before the download fails (finished parts are kept).
+    """
+
+    def __init__(self, part_size = PART_SIZE, connections = 4, max_connections = 8,
+                 max_bytes_per_second = None, retries = 3):
+        self.part_size = part_size
+        self.connections = connections
+        self.retries = retries
+        self.max_bytes_per_second = max_bytes_per_second
+        self.slots = threading.BoundedSemaphore(max_connections)
+        self.throttle_lock = threading.Lock()
+        self.next_send = time.monotonic()
+
+    def throttle(self, nbytes):
+        # Pace reads so all threads together stay under max_bytes_per_second
+        if not self.max_bytes_per_second:
+            return
+        with self.throttle_lock:
+            now = time.monotonic()
+            start = max(now, self.next_send)
+            self.next_send = start + nbytes / self.max_bytes_per_second
+        time.sleep(max(0.0, start - now))
+
+    def probe(self, url):
+        """Return (size, etag, accepts ranges) from a HEAD request."""
+        with urllib.request.urlopen(urllib.request.Request(url, method = "HEAD"), timeout = 60) as response:
+            size = response.headers.get("Content-Length")
+            ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            return (int(size) if size is not None else None), response.headers.get("ETag"), ranges
+
+    def copy(self, response, f, nbytes = None):
+        written = 0
+        while nbytes is None or written < nbytes:
+            block = response.read(READ_SIZE if nbytes is None else min(READ_SIZE, nbytes - written))
+            if not block:
+                break
+            self.throttle(len(block))
+            f.write(block)
+            written += len(block)
+        return written
+
+    def fetch_part(self, url, partial_path, etag, start, end):
+        headers = {"Range": f"bytes={start}-{end - 1}"}
+        if etag:
+            # A changed file is sent whole (200) instead of the range, which fails below
+            headers["If-Range"] = etag
+
+        with self.slots:
+            with urllib.request.urlopen(urllib.request.Request(url, headers = headers), timeout = 300) as response:
+                content_range = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", response.headers.get("Content-Range", ""))
+                if response.status != 206 or not content_range or int(content_range.group(1)) != start:
+                    raise DownloadError(f"{url}: expected bytes {start}-{end - 1}, got HTTP {response.status}")
+
+                with open(partial_path, "r+b") as f:
+                    f.seek(start)
+                    written = self.copy(response, f, end - start)
+
+        if written != end - start:
+            raise DownloadError(f"{url}: part at {start} is {written} bytes, expected {end - start}")
+
+    def fetch_part_with_retries(self, url, partial_path, etag, start, end):
+        for attempt in range(self.retries):
+            try:
+                return self.fetch_part(url, partial_path, etag, start, end)
+            except Exception as e:
+                if attempt == self.retries - 1:
+                    raise
+                print(f"Retrying bytes {start}-{end - 1} of {url} ({e})")
+                time.sleep(2 ** attempt)
+
+    def stream(self, url, path):
+        # No usable range support: one GET, no resume
+        with self.slots:
+            with urllib.request.urlopen(url, timeout = 300) as response, open(path, "wb") as f:
+                self.copy(response, f)
+
+    def __call__(self, url, path):
+        size, etag, ranges = self.probe(url)
+        if not ranges or size is None or size <= self.part_size:
+            self.stream(url, path)
+            return
+
+        # The partial file and its state sit next to path under a name derived
+        # from the URL, so a later attempt at the same URL finds them
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        partial_path = os.path.join(os.path.dirname(path) or ".", f"{key}.partial")
+        state_path = partial_path + ".state"
+
+        state = read_state(state_path)
+        resumable = (
+            state is not None and os.path.exists(partial_path)
+            and (state["url"], state["size"], state["etag"], state["part_size"]) == (url, size, etag, self.part_size)
+        )
+        if not resumable:
+            state = {"url": url, "size": size, "etag": etag, "part_size": self.part_size, "done": []}
+            with open(partial_path, "wb") as f:
+                f.truncate(size)
+            write_state(state_path, state)
+
+        parts = [(start, min(start + self.part_size, size)) for start in range(0, size, self.part_size)]
+        done = set(state["done"])
+        todo = [index for index in range(len(parts)) if index not in done]
+        if resumable:
+            print(f"Resuming {url}: {len(done)} of {len(parts)} parts already downloaded")
+
+        state_lock = threading.Lock()
+
+        def fetch(index):
+            self.fetch_part_with_retries(url, partial_path, etag, *parts[index])
+            with state_lock:
+                state["done"].append(index)
+                write_state(state_path, state)
+
+        with ThreadPoolExecutor(max_workers = self.connections) as executor:
+            # list() re-raises the first failure; finished parts stay recorded
+            list(executor.map(fetch, todo))
+
+        actual_size = os.path.getsize(partial_path)
+        if actual_size != size:
+            raise DownloadError(f"{url}: expected {size} bytes, got {actual_size}")
+
+        # Single-part S3 / CloudFront ETags are the MD5 of the body
+        md5 = (etag or "").strip('"')
+        if re.fullmatch(r"[0-9a-f]{32}", md5):
+            digest = file_md5(partial_path)
+            if digest != md5:
+                os.remove(partial_path)
+                os.remove(state_path)
+                raise DownloadError(f"{url}: md5 mismatch ({digest} != {md5})")
+
+        os.replace(partial_path, path)
+        os.remove(state_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (3, 4, 5):
+        print("usage: python tlc_download.py URL DEST [CONNECTIONS] [MAX_MB_PER_SECOND]")
+        sys.exit(2)
+
+    connections = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    limit = float(sys.argv[4]) * 1024 ** 2 if len(sys.argv) > 4 else None
+    start = time.perf_counter()
+    RangeDownloader(connections = connections, max_connections = connections, max_bytes_per_second = limit)(
+        sys.argv[1], sys.argv[2]
+    )
+    print(f"Downloaded {sys.argv[2]} ({os.path.getsize(sys.argv[2]) / 1024 ** 2:.1f} MB) "
+          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,308 @@
+"""
+Write objects to GCS (or a local stand-in) as a stream, without a local file.
+
+A backend hands out binary writers for object names:
+
+    GCSBackend(bucket)      resumable uploads of chunk_size parts (blob.open("wb"))
+    LocalBackend(root)      files under root, renamed into place on success;
+                            for tests and runs without GCS credentials
+
+GCSBackend also works against a fake-GCS server: point STORAGE_EMULATOR_HOST
+at it and create the storage client as usual.
+
+upload_file uploads a local file. Files over a threshold are split into
+parts that are uploaded concurrently as temporary objects, composed into
+the final object server-side (GCS compose, at most 32 parts) and then
+deleted, so one large file uses several connections. sync_file wraps it:
+the local CRC32C/MD5 are compared against the object's metadata (from one
+cached listing per run) and identical objects are skipped. Otherwise the
+upload is made with a generation-match precondition and its reported
+CRC32C is checked.
+
+stream_url copies an HTTP response body into an object. A reader thread
+fills a bounded queue of chunk_size blocks while the upload drains it, so
+the download and the upload overlap and at most buffer_blocks blocks are in
+memory. A body shorter than its Content-Length aborts the upload, so a
+truncated object is never committed.
+
+    import tlc_storage
+    backend = tlc_storage.GCSBackend(bucket)
+    tlc_storage.stream_url(url, backend, "yellow_tripdata_2024-01.parquet")
+"""
+
+import base64
+import contextlib
+import hashlib
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import google_crc32c
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+CHUNK_SIZE = 8 * 1024 * 1024
+COMPOSITE_THRESHOLD = 64 * 1024 * 1024
+MAX_COMPOSE_PARTS = 32
+
+
+def file_checksums(path, block_size = CHUNK_SIZE):
+    """CRC32C and MD5 of a local file, base64-encoded the way GCS reports them."""
+    crc32c = google_crc32c.Checksum()
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            crc32c.update(block)
+            md5.update(block)
+    return base64.b64encode(crc32c.digest()).decode(), base64.b64encode(md5.digest()).decode()
+
+
+def blob_stat(blob):
+    # Composite objects have a CRC32C but no MD5
+    return {"size": blob.size, "generation": blob.generation, "crc32c": blob.crc32c, "md5": blob.md5_hash}
+
+
+class GCSBackend:
+    def __init__(self, bucket, chunk_size = CHUNK_SIZE):
+        # Resumable upload chunks have to be a multiple of 256 KB
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+
+    def writer(self, name):
+        # The upload is finalized on a clean exit and cancelled on an exception
+        return self.bucket.blob(name).open("wb", chunk_size = self.chunk_size, ignore_flush = True)
+
+    def upload_range(self, path, offset, length, name, if_generation_match = None):
+        blob = self.bucket.blob(name)
+        blob.chunk_size = self.chunk_size
+        with open(path, "rb") as f:
+            f.seek(offset)
+            # The client checks the CRC32C of what it sent against the one GCS computed
+            blob.upload_from_file(f, size = length, if_generation_match = if_generation_match, checksum = "crc32c")
+        return blob_stat(blob)
+
+    def compose(self, part_names, name, if_generation_match = None):
+        blob = self.bucket.blob(name)
+        blob.compose([self.bucket.blob(part_name) for part_name in part_names], if_generation_match = if_generation_match)
+        return blob_stat(blob)
+
+    def delete(self, name):
+        try:
+            self.bucket.blob(name).delete()
+        except NotFound:
+            pass
+
+    def stat(self, name):
+        blob = self.bucket.get_blob(name)
+        return blob_stat(blob) if blob is not None else None
+
+    def list(self, prefix = ""):
+        # One listing call returns the metadata of every object under prefix
+        return {blob.name: blob_stat(blob) for blob in self.bucket.list_blobs(prefix = prefix)}
+
+    def exists(self, name):
+        return self.bucket.blob(name).exists()
+
+    def uri(self, name):
+        return f"gs://{self.bucket.name}/{name}"
+
+
+class LocalBackend:
+    def __init__(self, root, chunk_size = CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    @contextlib.contextmanager
+    def writer(self, name, if_generation_match = None):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), suffix = ".part")
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+
+            # Same precondition as GCS, with the mtime standing in for the generation
+            if if_generation_match is not None:
+                current = self.stat(name, checksums = False)
+                if (current["generation"] if current else 0) != if_generation_match:
+                    raise PreconditionFailed(f"{name}: generation does not match {if_generation_match}")
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def upload_range(self, path, offset, length, name, if_generation_match = None):
+        with open(path, "rb") as src, self.writer(name, if_generation_match) as dest:
+            src.seek(offset)
+            while length > 0:
+                block = src.read(min(self.chunk_size, length))
+                if not block:
+                    raise IOError(f"{path}: ended {length} bytes early")
+                dest.write(block)
+                length -= len(block)
+        return self.stat(name)
+
+    def compose(self, part_names, name, if_generation_match = None):
+        with self.writer(name, if_generation_match) as dest:
+            for part_name in part_names:
+                with open(os.path.join(self.root, part_name), "rb") as src:
+                    shutil.copyfileobj(src, dest, self.chunk_size)
+        return self.stat(name)
+
+    def delete(self, name):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(self.root, name))
+
+    def stat(self, name, checksums = True):
+        path = os.path.join(self.root, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        crc32c, md5 = file_checksums(path, self.chunk_size) if checksums else (None, None)
+        return {"size": st.st_size, "generation": st.st_mtime_ns, "crc32c": crc32c, "md5": md5}
+
+    def list(self, prefix = ""):
+        # Checksums are computed on the fly here, which is fine for a test stand-in
+        objects = {}
+        for root, _, files in os.walk(self.root):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(root, file_name), self.root).replace(os.sep, "/")
+                if name.startswith(prefix) and not name.endswith(".part"):
+                    objects[name] = self.stat(name)
+        return objects
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.root, name))
+
+    def uri(self, name):
+        return os.path.join(self.root, name)
+
+
+def upload_file(backend, path, name, threshold = COMPOSITE_THRESHOLD, parts = 8, workers = 8,
+                if_generation_match = None):
+    """Upload path as object name; large files as a parallel composite upload.
+
+    Args:
+      threshold: Files smaller than this are uploaded as one stream.
+      parts: Number of parts a large file is split into (at most 32).
+      workers: Parts uploaded at the same time.
+      if_generation_match: Only replace the object if it is still at this
+        generation (0: only if it does not exist).
+
+    Returns:
+      (number of parts, metadata of the uploaded object)
+    """
+    size = os.path.getsize(path)
+    parts = min(parts, MAX_COMPOSE_PARTS)
+
+    if size < threshold or parts < 2:
+        return 1, backend.upload_range(path, 0, size, name, if_generation_match)
+
+    # A run-specific prefix keeps concurrent uploads of the same name apart
+    part_size = -(-size // parts)
+    prefix = f"{name}.part-{uuid.uuid4().hex[:8]}"
+    ranges = [
+        (offset, min(part_size, size - offset), f"{prefix}-{index:02d}")
+        for index, offset in enumerate(range(0, size, part_size))
+    ]
+
+    try:
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            list(executor.map(lambda part: backend.upload_range(path, *part), ranges))
+
+        # The precondition applies to the final object only
+        stat = backend.compose([part_name for _, _, part_name in ranges], name, if_generation_match)
+    finally:
+        # Temporary parts are billed storage; remove them whether or not the compose happened
+        for _, _, part_name in ranges:
+            backend.delete(part_name)
+
+    return len(ranges), stat
+
+
+def sync_file(backend, path, name, remote = None, **upload_options):
+    """Upload path as object name unless an identical object is already there.
+
+    The local CRC32C/MD5 are computed once and compared against remote, a
+    cached backend.list() (or a fresh stat when remote is None). A changed
+    object is replaced only if it is still at the generation that was
+    compared against, and the checksum GCS reports back has to match.
+
+    Returns:
+      The number of parts uploaded; 0 if the object was already identical.
+    """
+    crc32c, md5 = file_checksums(path)
+    current = remote.get(name) if remote is not None else backend.stat(name)
+
+    if (current is not None and current["size"] == os.path.getsize(path) and current["crc32c"] == crc32c
+            and current["md5"] in (None, md5)):
+        return 0
+
+    parts, stat = upload_file(
+        backend, path, name,
+        if_generation_match = current["generation"] if current is not None else 0,
+        **upload_options
+    )
+
+    if stat["crc32c"] != crc32c:
+        backend.delete(name)
+        raise IOError(f"{name}: uploaded CRC32C {stat['crc32c']} does not match the local {crc32c}")
+
+    if remote is not None:
+        remote[name] = stat
+    return parts
+
+
+def stream_url(url, backend, name, buffer_blocks = 4):
+    """Copy the body of url into object name of backend; returns the bytes copied."""
+    blocks = queue.Queue(maxsize = buffer_blocks)
+    stop = threading.Event()
+    headers = {}
+
+    def put(item):
+        # Give up once the upload side has failed, instead of blocking forever
+        while not stop.is_set():
+            try:
+                blocks.put(item, timeout = 1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            with urllib.request.urlopen(url, timeout = 300) as response:
+                headers["length"] = response.headers.get("Content-Length")
+                while block := response.read(backend.chunk_size):
+                    if not put(block):
+                        return
+            put(None)
+        except BaseException as e:
+            put(e)
+
+    reader = threading.Thread(target = read, daemon = True)
+    reader.start()
+    copied = 0
+
+    try:
+        with backend.writer(name) as f:
+            while (block := blocks.get()) is not None:
+                if isinstance(block, BaseException):
+                    raise block
+                f.write(block)
+                copied += len(block)
+
+            # Raising here cancels the upload
+            if headers.get("length") is not None and copied != int(headers["length"]):
+                raise IOError(f"{url}: expected {headers['length']} bytes, got {copied}")
+    finally:
+        stop.set()
+        reader.join()
+
+    return copied